@@ -0,0 +1,106 @@
+import numpy as np
+
+from parebrick.utils.data.parsers import GenomesPermutations, BLOCKS_SEPARATOR
+
+MIN_BLOCK_LENGTH, MAX_BLOCK_LENGTH = 1000, 20000
+MAX_GAP_LENGTH = 2000
+
+
+def genome_name(i):
+    return f'genome_{i:05d}'
+
+
+# Random binary tree made by joining random pairs of subtrees, nodes 0..n-1 are leaves, every next node is parent of
+# two previous ones, so parents always go after their children and the last node is the root.
+def random_tree(n, rng):
+    children, active = {}, list(range(n))
+    for node in range(n, 2 * n - 1):
+        first = active.pop(rng.integers(len(active)))
+        second = active.pop(rng.integers(len(active)))
+        children[node] = (first, second)
+        active.append(node)
+
+    branch_lengths = rng.exponential(1.0, 2 * n - 1)
+    return children, branch_lengths
+
+
+def tree_newick(n, children, branch_lengths):
+    newick = {leaf: genome_name(leaf) for leaf in range(n)}
+    for node in range(n, 2 * n - 1):
+        first, second = children[node]
+        newick[node] = f'({newick.pop(first)}:{branch_lengths[first]:.6f},' \
+                       f'{newick.pop(second)}:{branch_lengths[second]:.6f})'
+    return newick[2 * n - 2] + ';'
+
+
+def evolve(permutation, length, duplication_rate, rearrangement_rate, rng):
+    permutation = permutation.copy()
+    for _ in range(rng.poisson(rearrangement_rate * length)):
+        # inversion of random segment
+        i, j = np.sort(rng.integers(0, len(permutation) + 1, 2))
+        permutation[i:j] = -permutation[i:j][::-1]
+
+    for _ in range(rng.poisson(duplication_rate * length)):
+        # copy of random block inserted to random place in random orientation
+        block = permutation[rng.integers(len(permutation))] * rng.choice([-1, 1])
+        permutation = np.insert(permutation, rng.integers(len(permutation) + 1), block)
+
+    return permutation
+
+
+# Genomes evolved along random tree from root genome +1 +2 ... +blocks, expected numbers of inversions and
+# duplications on every branch are rates multiplied by branch length (1 on average).
+def generate_genomes(n_genomes, n_blocks, duplication_rate=0.05, rearrangement_rate=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    children, branch_lengths = random_tree(n_genomes, rng)
+
+    root = 2 * n_genomes - 2
+    permutations = {root: np.arange(1, n_blocks + 1, dtype=np.int32)}
+    for node in range(root, n_genomes - 1, -1):
+        parent_permutation = permutations.pop(node)
+        for child in children[node]:
+            permutations[child] = evolve(parent_permutation, branch_lengths[child], duplication_rate,
+                                         rearrangement_rate, rng)
+
+    genomes = [genome_name(i) for i in range(n_genomes)]
+    return GenomesPermutations(genomes, [permutations[i] for i in range(n_genomes)]), \
+        tree_newick(n_genomes, children, branch_lengths)
+
+
+# Blocks coords in Sibelia format: blocks of every genome are placed one after another with random gaps,
+# every block has the same length in all genomes
+def write_blocks_coords(permutations, file, seed=0):
+    rng = np.random.default_rng(seed)
+    n_blocks = max((int(np.abs(p).max()) for p in permutations.permutations if len(p)), default=0)
+    block_lengths = rng.integers(MIN_BLOCK_LENGTH, MAX_BLOCK_LENGTH, n_blocks + 1)
+
+    seq_ids, blocks, forward, starts, ends, sizes = [], [], [], [], [], []
+    for seq_id, permutation in enumerate(permutations.permutations, start=1):
+        lengths = block_lengths[np.abs(permutation)]
+        gaps = rng.integers(0, MAX_GAP_LENGTH, len(permutation) + 1)
+        begins = 1 + np.cumsum(gaps[:-1]) + np.cumsum(lengths) - lengths
+
+        seq_ids.append(np.full(len(permutation), seq_id))
+        blocks.append(np.abs(permutation))
+        forward.append(permutation > 0)
+        starts.append(begins)
+        ends.append(begins + lengths)
+        sizes.append(int(gaps.sum() + lengths.sum()))
+
+    seq_ids, blocks, forward, starts, ends = (np.concatenate(xs) if xs else np.zeros(0, dtype=np.int64)
+                                              for xs in (seq_ids, blocks, forward, starts, ends))
+    order = np.argsort(blocks, kind='stable')
+
+    with open(file, 'w') as f:
+        f.write('Seq_id\tSize\tDescription\n')
+        for seq_id, (genome, size) in enumerate(zip(permutations.genomes, sizes), start=1):
+            f.write(f'{seq_id}\t{size}\t{genome}\n')
+        f.write(BLOCKS_SEPARATOR + '\n')
+
+        bounds = np.flatnonzero(np.diff(blocks[order])) + 1
+        for occurrences in np.split(order, bounds) if len(order) else []:
+            f.write(f'Block #{blocks[occurrences[0]]}\nSeq_id\tStrand\tStart\tEnd\tLength\n')
+            for i in occurrences.tolist():
+                start, end = (starts[i], ends[i]) if forward[i] else (ends[i], starts[i])
+                f.write(f'{seq_ids[i]}\t{"+" if forward[i] else "-"}\t{start}\t{end}\t{ends[i] - starts[i]}\n')
+            f.write(BLOCKS_SEPARATOR + '\n')
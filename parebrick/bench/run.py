@@ -0,0 +1,96 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import parebrick.main as pipeline
+
+from parebrick.bench.generators import generate_genomes, write_blocks_coords
+
+logger = logging.getLogger()
+
+TREE_FILENAME = 'tree.nwk'
+RESULTS_FILENAME = 'bench_results.csv'
+RESULTS_HEADER = ['genomes', 'blocks', 'module', 'elapsed_seconds', 'cpu_seconds', 'children_cpu_seconds',
+                  'rss_start_mb', 'peak_rss_mb', 'items']
+
+
+def generate_dataset(folder, n_genomes, n_blocks, duplication_rate, rearrangement_rate, seed):
+    os.makedirs(folder, exist_ok=True)
+    permutations, newick = generate_genomes(n_genomes, n_blocks, duplication_rate, rearrangement_rate, seed)
+
+    permutations.write_grimm(os.path.join(folder, pipeline.GRIMM_FILENAME))
+    write_blocks_coords(permutations, os.path.join(folder, pipeline.BLOCKS_COORD_FILENAME), seed)
+    with open(os.path.join(folder, TREE_FILENAME), 'w') as f:
+        f.write(newick + '\n')
+
+
+# pipeline is run in separate process, so peak memory of every run is measured separately
+def run_pipeline(data_folder, output_folder, args):
+    command = [sys.executable, '-m', 'parebrick.main', '-b', data_folder, '-t',
+               os.path.join(data_folder, TREE_FILENAME), '-o', output_folder, '-ca', 'False'] + args
+    # parebrick is imported in subprocess from the same place as here, even if it's not installed
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(pipeline.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])))
+    with open(os.path.join(os.path.dirname(output_folder.rstrip('/')), 'pipeline.log'), 'w') as log:
+        subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, check=True, env=env)
+
+    with open(os.path.join(output_folder, pipeline.METRICS_FILE)) as f:
+        return json.load(f)['modules']
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    pipeline.initialize()
+
+    parser = argparse.ArgumentParser(
+        description='Generates synthetic genomes and trees of different sizes and times every stage of PaReBrick '
+                    'on them.')
+
+    parser.add_argument('--genomes', '-g', type=int, nargs='+', default=[10, 100, 1000, 5000],
+                        help='Numbers of genomes of datasets. Default: 10 100 1000 5000.')
+    parser.add_argument('--blocks', '-bl', type=int, default=500, help='Number of blocks in root genome. Default: 500.')
+    parser.add_argument('--duplication_rate', '-dr', type=float, default=0.05,
+                        help='Expected number of block duplications on branch of tree. Default: 0.05.')
+    parser.add_argument('--rearrangement_rate', '-rr', type=float, default=0.5,
+                        help='Expected number of inversions on branch of tree. Default: 0.5.')
+    parser.add_argument('--seed', '-s', type=int, default=0, help='Seed of random generator. Default: 0.')
+    parser.add_argument('--output', '-o', default='parebrick_bench', help='Path to output folder.')
+    parser.add_argument('--generate_only', '-go', type=pipeline.str2bool, default=False, const=True, nargs='?',
+                        help='Only generate datasets without running pipeline on them. Default: False.')
+    parser.add_argument('--render_top', '-rt', type=int, default=10,
+                        help='Number of rendered trees in every module of pipeline. Default: 10.')
+
+    d, pipeline_args = parser.parse_known_args()
+    pipeline_args += ['-rt', str(d.render_top)]
+
+    rows = []
+    for n_genomes in d.genomes:
+        folder = os.path.join(d.output, f'genomes_{n_genomes}')
+        data_folder = os.path.join(folder, 'input')
+
+        logger.info(f'Generating dataset of {n_genomes} genomes and {d.blocks} blocks')
+        generate_dataset(data_folder, n_genomes, d.blocks, d.duplication_rate, d.rearrangement_rate, d.seed)
+        if d.generate_only: continue
+
+        logger.info(f'Running pipeline on {n_genomes} genomes')
+        for module in run_pipeline(data_folder, os.path.join(folder, 'output'), pipeline_args):
+            rows.append([n_genomes, d.blocks, module['module'], module['elapsed_seconds'], module['cpu_seconds'],
+                         module['children_cpu_seconds'], module['rss_start_mb'], module['peak_rss_mb'],
+                         json.dumps(module['items'])])
+            logger.info(f'{module["module"]}: {module["elapsed_seconds"]:.2f} seconds, '
+                        f'peak RSS {module["peak_rss_mb"]} MB')
+
+        # results are rewritten after every dataset, so they are kept if next one runs out of time or memory
+        with open(os.path.join(d.output, RESULTS_FILENAME), 'w') as f:
+            wtr = csv.writer(f)
+            wtr.writerow(RESULTS_HEADER)
+            wtr.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
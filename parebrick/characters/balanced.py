@@ -1,110 +1,99 @@
-from bg.grimm import GRIMMReader
-from bg.tree import BGTree
-from bg.genome import BGGenome
-from bg.vertices import BGVertex
-
-
 import numpy as np
 
 import os
 import csv
 
-from collections import Counter
+from parebrick.characters.breakpoint_graph import BreakpointGraph, vertex_name
+from parebrick.characters.characters_table import write_characters_table
+from parebrick.tree.render_pool import RenderPool
+from parebrick.utils.decorators import metrics
 
-get_colors_by_edge = lambda e: e.multicolor.multicolors
+from multiprocessing import Pool
 
 def white_proportion(colors):
     return np.mean(list(map(lambda c: c == 0, colors)))
 
-def get_character_by_edge(bg, edge, genomes, neighbour_index):
-    def get_neighbour_with_genome(v, genome):
-        return neighbour_index[(v, genome)]
-
-    def get_genome_character_state_by_edge(genome):
-        if cnt[genome] == 1:
-            return 0
-        else:
-            v1, v2 = edge.vertex1.name, edge.vertex2.name
-            if v1 > v2: v1, v2 = v2, v1
-
-            try:
-                v1_neighbour = get_neighbour_with_genome(v1, genome)
-                v2_neighbour = get_neighbour_with_genome(v2, genome)
-            except KeyError:
-                return 2
-
-            neighbour_edge = bg.get_edge_by_two_vertices(v1_neighbour, v2_neighbour)
-            if neighbour_edge:
-                neighbour_edge_genomes = get_colors_by_edge(neighbour_edge)
-                neighbour_edge_genomes_count = sum(neighbour_edge_genomes.values())
-
-                neighbour_edge_genomes_names = set(g for g in genomes if neighbour_edge_genomes[BGGenome(g)])
-                white_genomes_at_neighbour_edge = len(neighbour_edge_genomes_names & white_genomes)
-
-                if white_genomes_at_neighbour_edge < 1:
-                # if neighbour_edge_genomes_count <= len(genomes) // 2:
-                    return 1
-
-                pair = (v1_neighbour, v2_neighbour)
-                if pair not in possible_edges:
-                    possible_edges.append(pair)
-                return 3 + possible_edges.index(pair)
-            else:
-                return 1
-
-    cnt = Counter([genome.name
-                   for genome, count in get_colors_by_edge(edge).items()
-                   for _ in range(count)])
-    possible_edges = []
-    white_genomes = set(g for g in genomes if BGGenome(g))
-    return {genome: get_genome_character_state_by_edge(genome) for genome in genomes}, possible_edges
-
-def construct_vertex_genome_index(bg):
-    neighbour_index = {}
-    for v in bg.bg:
-        for edge in bg.get_edges_by_vertex(v):
-            colors = get_colors_by_edge(edge)
-            for color in colors:
-                neighbour_index[(str(v), color.name)] = edge.vertex2
-
-    return neighbour_index
-
-def get_characters_balanced(grimm_file, genomes, logger):
-    bg = GRIMMReader.get_breakpoint_graph(open(grimm_file))
-    logger.info('Breakpoint graph parsed')
+def get_character_by_edge(graph, v1, v2, genomes, genomes_index, genomes_mask):
+    present = graph.edge_genomes(graph.edge_id(v1, v2))[genomes_index]
+    v1_neighbours, v2_neighbours = graph.partners(v1)[genomes_index], graph.partners(v2)[genomes_index]
 
-    logger.info(f'Edges in breakpoint graph: {len(list(bg.edges()))}')
+    states = np.ones(len(genomes), dtype=np.int64)
+    states[(v1_neighbours == -1) | (v2_neighbours == -1)] = 2
+    states[present] = 0
 
-    characters = []
+    # broken adjacency is inversion if edge of neighbours exists in some of genomes, otherwise it's complex break
+    broken = np.flatnonzero(states == 1)
+    neighbour_edges = graph.edge_id(v1_neighbours[broken], v2_neighbours[broken])
+    exists = neighbour_edges != -1
+    exists[exists] = (graph.bits[neighbour_edges[exists]] & genomes_mask).any(axis=1)
+    inversions = broken[exists]
 
-    # consistency_checker = TreeConsistencyChecker(tree_file)
-    for i, component_bg in enumerate(bg.connected_components_subgraphs()):
-        nodes_len = len(list(component_bg.nodes()))
-        if nodes_len == 2: continue
+    # pairs of neighbours are numbered in order of first genome with them
+    pairs = v1_neighbours[inversions] * graph.n + v2_neighbours[inversions]
+    unique_pairs, first, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    states[inversions] = 3 + np.argsort(order)[inverse]
 
-        logger.info(f'Getting characters from breakpoint graph component, size={len(component_bg.bg)}')
+    possible_edges = [(vertex_name(pair // graph.n), vertex_name(pair % graph.n)) for pair in unique_pairs[order]]
+    return dict(zip(genomes, states.tolist())), possible_edges
 
-        neighbour_index = construct_vertex_genome_index(component_bg)
+def get_component_characters(graph, edges, genomes):
+    characters = []
+    genomes_index = np.array([graph.genome_index[genome] for genome in genomes], dtype=np.int64)
+    genomes_mask = graph.genomes_mask(genomes)
 
-        for edge in component_bg.edges():
-            v1, v2 = edge.vertex1.name, edge.vertex2.name
-            if v1 > v2: v1, v2 = v2, v1
+    for edge in edges:
+        v1, v2 = graph.u[edge], graph.v[edge]
+        if vertex_name(v1) > vertex_name(v2): v1, v2 = v2, v1
 
-            genome_colors, neighbour_edges = get_character_by_edge(component_bg, edge, genomes, neighbour_index)
-            if white_proportion(genome_colors.values()) < 0.33: continue
+        genome_colors, neighbour_edges = get_character_by_edge(graph, v1, v2, genomes, genomes_index, genomes_mask)
+        if white_proportion(genome_colors.values()) < 0.33: continue
 
-            labels = ['adjacency exists', 'complex break of adjacency', 'some block is not presented'] + \
-                     [f'inversion with {v1n}-{v2n}' for (v1n, v2n) in neighbour_edges]
+        labels = ['adjacency exists', 'complex break of adjacency', 'some block is not presented'] + \
+                 [f'inversion with {v1n}-{v2n}' for (v1n, v2n) in neighbour_edges]
 
-            characters.append((v1, v2, genome_colors, labels))
+        characters.append((vertex_name(v1), vertex_name(v2), genome_colors, labels))
 
     return characters
 
+def init_worker(worker_graph, worker_genomes):
+    global graph_in_worker, genomes_in_worker
+    graph_in_worker, genomes_in_worker = worker_graph, worker_genomes
+
+def get_component_characters_in_worker(edges):
+    return get_component_characters(graph_in_worker, edges, genomes_in_worker)
+
+def get_characters_balanced(permutations, genomes, logger, threads=1):
+    graph = BreakpointGraph(permutations)
+    logger.info('Breakpoint graph parsed')
+
+    logger.info(f'Edges in breakpoint graph: {len(graph)}')
+    metrics.count('edges', len(graph))
+
+    # genomes order defines order of states in characters, so it is fixed before sending to other processes
+    genomes = list(genomes)
+
+    def components():
+        for edges in graph.components():
+            nodes_len = graph.component_size(edges)
+            if nodes_len == 2: continue
+
+            logger.info(f'Getting characters from breakpoint graph component, size={nodes_len}')
+            yield edges
+
+    # components are independent, results are merged in order of components
+    if threads > 1:
+        with Pool(threads, init_worker, (graph, genomes)) as pool:
+            components_characters = list(pool.imap(get_component_characters_in_worker, components(), chunksize=16))
+    else:
+        components_characters = [get_component_characters(graph, edges, genomes) for edges in components()]
+
+    return [character for characters in components_characters for character in characters]
+
 def get_characters_stats_balanced(characters, tree_holder, distance_between_blocks):
     ans = []
-    for v1, v2, genome_colors, labels in characters:
-        tree_holder.count_innovations_fitch(genome_colors, count_second_color=False)
-
+    colorings = tree_holder.count_innovations_fitch_batch([char[2] for char in characters], count_second_color=False)
+    for (v1, v2, genome_colors, labels), _ in zip(characters, colorings):
         b1, b2 = int(v1[:-1]), int(v2[:-1])
         if b1 > b2: b1, b2 = b2, b1
 
@@ -112,7 +101,7 @@ def get_characters_stats_balanced(characters, tree_holder, distance_between_bloc
         score_break, count_break = tree_holder.count_parallel_breakpoints()
 
         white_strains = [strain for strain, color in genome_colors.items() if color == 0]
-        mean_break_length = np.mean([distance_between_blocks[(b1, b2)][strain] for strain in white_strains])
+        mean_break_length = np.mean(distance_between_blocks.get((b1, b2), white_strains))
 
         ans.append([f'{v1}-{v2}', int(mean_break_length), score_rear, count_rear, count_all_rear, score_break, count_break,
                     count_break <= 1])
@@ -139,11 +128,18 @@ def write_characters_csv_balanced(characters, folder):
             wtr = csv.writer(f)
             wtr.writerows(rows)
 
-def write_trees_balanced(characters, folder, show_branch_support, tree_holder, colors):
-    os.makedirs(folder, exist_ok=True)
+def write_characters_table_balanced(characters, file_name, parquet=False, logger=None):
+    write_characters_table(((i + 1, genome_colors, labels)
+                            for i, (_, _, genome_colors, labels) in enumerate(characters)), file_name, parquet, logger)
+
+def write_trees_balanced(characters, folder, show_branch_support, tree_holder, colors, threads=1, limit=None,
+                         **render_params):
+    if render_params.get('bundle_file') is None: os.makedirs(folder, exist_ok=True)
     fill_length = len(str(len(characters)))
 
-    for i, (v1, v2, genome_colors, labels) in enumerate(characters):
-        tree_holder.count_innovations_fitch(genome_colors)
-        tree_holder.draw(folder + f'id_{str(i + 1).zfill(fill_length)}_edge_{v1}-{v2}.pdf', legend_labels=labels,
-                         show_branch_support=show_branch_support, colors=colors)
\ No newline at end of file
+    characters = characters[:limit]
+    colorings = tree_holder.count_innovations_fitch_batch([char[2] for char in characters])
+    with RenderPool(tree_holder, threads, **render_params) as render_pool:
+        for i, ((v1, v2, genome_colors, labels), _) in enumerate(zip(characters, colorings)):
+            render_pool.draw(folder + f'id_{str(i + 1).zfill(fill_length)}_edge_{v1}-{v2}.pdf', legend_labels=labels,
+                             show_branch_support=show_branch_support, colors=colors)
\ No newline at end of file
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+def vertex_name(v):
+    return f'{v // 2}{"h" if v % 2 else "t"}'
+
+
+def union_find_components(n, u, v):
+    # roots are hooked to smaller roots of the other end of every edge, then paths are compressed,
+    # until both ends of all edges have the same root; root of component is its minimal vertex
+    parent = np.arange(n)
+    while len(u) > 0:
+        ru, rv = parent[u], parent[v]
+        if np.array_equal(ru, rv): break
+        np.minimum.at(parent, np.maximum(ru, rv), np.minimum(ru, rv))
+
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent): break
+            parent = grandparent
+
+    return parent
+
+
+# Breakpoint graph of circular genomes built from permutations of unique blocks, where every block occurs at most once
+# in every genome. Vertex of block b is 2b for its tail and 2b + 1 for its head, edges are sorted pairs of vertices
+# with genomes of every edge stored as bitsets of uint64 words and incident edges of vertices stored in CSR form.
+class BreakpointGraph:
+    def __init__(self, permutations):
+        self.genomes = list(permutations.genomes)
+        self.genome_index = {genome: i for i, genome in enumerate(self.genomes)}
+        self.words = max(1, (len(self.genomes) + 63) // 64)
+
+        us, vs, edge_genomes = [], [], []
+        for i, permutation in enumerate(permutations.permutations):
+            if len(permutation) == 0: continue
+            blocks, forward = np.abs(permutation).astype(np.int64), permutation > 0
+            entry, exit = 2 * blocks + ~forward, 2 * blocks + forward
+            # adjacency of every block with the next one, last block is adjacent to the first one
+            us.append(exit)
+            vs.append(np.roll(entry, -1))
+            edge_genomes.append(np.full(len(permutation), i))
+
+        us, vs, edge_genomes = (np.concatenate(xs) if xs else np.zeros(0, dtype=np.int64)
+                                for xs in (us, vs, edge_genomes))
+        self.n = int(max(us.max(initial=0), vs.max(initial=0))) + 1
+
+        keys, inverse = np.unique(np.minimum(us, vs) * self.n + np.maximum(us, vs), return_inverse=True)
+        self.keys = keys
+        self.u, self.v = keys // self.n, keys % self.n
+
+        self.bits = np.zeros((len(keys), self.words), dtype=np.uint64)
+        np.bitwise_or.at(self.bits, (inverse, edge_genomes // 64),
+                         np.left_shift(np.uint64(1), (edge_genomes % 64).astype(np.uint64)))
+
+        ends = np.concatenate([self.u, self.v])
+        order = np.argsort(ends, kind='stable')
+        self.indptr = np.append(0, np.cumsum(np.bincount(ends, minlength=self.n)))
+        self.adj_edge = order % len(keys) if len(keys) else order
+        self.adj_vertex = np.concatenate([self.v, self.u])[order]
+
+        self.component = union_find_components(self.n, self.u, self.v)
+        self.has_vertex = np.bincount(ends, minlength=self.n) > 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def genomes_mask(self, genomes):
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for genome in genomes:
+            i = self.genome_index[genome]
+            mask[i // 64] |= np.uint64(1) << np.uint64(i % 64)
+        return mask
+
+    def edge_genomes(self, edges):
+        # bool matrix edges x genomes
+        bits = np.unpackbits(self.bits[edges].view(np.uint8), axis=-1, bitorder='little')
+        return bits.reshape(*np.shape(edges), -1)[..., :len(self.genomes)].astype(bool)
+
+    def edge_id(self, u, v):
+        keys = np.minimum(u, v) * self.n + np.maximum(u, v)
+        i = np.minimum(np.searchsorted(self.keys, keys), max(0, len(self.keys) - 1))
+        return np.where((len(self.keys) > 0) & (self.keys[i] == keys), i, -1)
+
+    # vertex adjacent to given one in every genome, -1 for genomes without this vertex
+    def partners(self, vertex):
+        partners = np.full(len(self.genomes), -1, dtype=np.int64)
+        start, end = self.indptr[vertex], self.indptr[vertex + 1]
+        present = self.edge_genomes(self.adj_edge[start:end])
+        for adj_vertex, adj_present in zip(self.adj_vertex[start:end], present):
+            partners[adj_present] = adj_vertex
+        return partners
+
+    # edges of every component in order of their minimal vertices, edges in component are ordered by vertices
+    def components(self):
+        edge_components = self.component[self.u]
+        order = np.argsort(edge_components, kind='stable')
+        _, starts = np.unique(edge_components[order], return_index=True)
+        return np.split(order, starts[1:]) if len(order) else []
+
+    def component_size(self, edges):
+        return len(np.unique(np.concatenate([self.u[edges], self.v[edges]])))
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from collections import defaultdict
+
+CHARACTERS_TABLE_COLUMNS = ['character_id', 'strain', 'character_state', 'character_state_annotation']
+CHARACTERS_TABLE_CHUNK_ROWS = 2 ** 20
+
+
+# Characters of module as one long table: a row for every strain of every character, characters are given as
+# (character_id, {strain: state}, labels of states). Table is built in memory and written at once.
+def write_characters_table(characters, file_name, parquet=False, logger=None):
+    columns = {column: [] for column in CHARACTERS_TABLE_COLUMNS}
+    for character_id, genome_colors, labels in characters:
+        columns['character_id'].extend([character_id] * len(genome_colors))
+        columns['strain'].extend(genome_colors.keys())
+        columns['character_state'].extend(genome_colors.values())
+        columns['character_state_annotation'].extend(labels[color] for color in genome_colors.values())
+
+    df = pd.DataFrame(columns, columns=CHARACTERS_TABLE_COLUMNS)
+    df.to_csv(file_name + '.csv', index=False)
+
+    if parquet:
+        try:
+            df.to_parquet(file_name + '.parquet', index=False)
+        except ImportError:
+            if logger: logger.warning('Characters table is not written in parquet format, pyarrow or fastparquet '
+                                      'is required for it')
+
+
+# rows of given characters by their ids, table is read by chunks and only rows of these characters are kept
+def read_characters_table(file, character_ids, chunksize=CHARACTERS_TABLE_CHUNK_ROWS):
+    character_ids = list(map(int, character_ids))
+    characters = defaultdict(list)
+    for chunk in pd.read_csv(file, usecols=CHARACTERS_TABLE_COLUMNS, chunksize=chunksize, keep_default_na=False,
+                             dtype={'character_id': 'int64', 'strain': str, 'character_state': 'int64',
+                                    'character_state_annotation': str}):
+        for row in chunk[chunk['character_id'].isin(character_ids)].to_dict('records'):
+            characters[row['character_id']].append(row)
+    return characters
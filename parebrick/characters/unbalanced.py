@@ -1,26 +1,42 @@
 import csv
 import os
 
+import numpy as np
+
 from statistics import mean
 
 from collections import defaultdict
 from textwrap import wrap
 
+from parebrick.tree.render_pool import RenderPool
+from parebrick.characters.characters_table import write_characters_table
+from parebrick.clustering.distance_matrices import characters_matrix
+
+
+# identical characters are found as equal rows of characters x genomes matrix of states,
+# returns index of first character with every distinct pattern and index of pattern for every character
+def distinct_characters(characters):
+    if len(characters) == 0: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    _, first, inverse = np.unique(characters_matrix(characters), axis=0, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
 
-def get_characters_stats_unbalanced(blocks, characters, tree_holder):
-    ans = []
-    for block, genome_colors in zip(blocks, characters):
-        tree_holder.count_innovations_fitch(genome_colors)
 
+# stats are counted once for every distinct copy number pattern, only block differs for blocks with the same pattern
+def get_characters_stats_unbalanced(blocks, characters, tree_holder):
+    first, inverse = distinct_characters(characters)
+    distinct_stats = []
+    colorings = tree_holder.count_innovations_fitch_batch([characters[i] for i in first])
+    for i, _ in zip(first, colorings):
         ins_del_dict = tree_holder.insertions_deltitions
         insetions = sum(len(nodes) for change, nodes in ins_del_dict.items() if change > 0)
         delitions = sum(len(nodes) for change, nodes in ins_del_dict.items() if change < 0)
 
         score_rear, count_rear, count_all_rear = tree_holder.count_parallel_rearrangements(skip_grey=False)
-        mean_copies = mean(genome_colors.values())
-        ans.append([block, score_rear, count_rear, count_all_rear, mean_copies, count_all_rear <= 1, insetions, delitions])
+        mean_copies = mean(characters[i].values())
+        distinct_stats.append([score_rear, count_rear, count_all_rear, mean_copies, count_all_rear <= 1, insetions,
+                               delitions])
 
-    return ans
+    return [[block] + distinct_stats[j] for block, j in zip(blocks, inverse)]
 
 
 def write_stats_csv_unbalanced(stats, cls, stats_file):
@@ -68,18 +84,26 @@ def write_characters_csv_unbalanced(unique_chars_list, folder):
                     wtr = csv.writer(f)
                     wtr.writerows(rows)
 
-def write_trees_unbalanced(unique_chars_list, folder, show_branch_support, tree_holder, colors):
-    fill_length = len(str(len(unique_chars_list)))
-    for cl, unique_chars in enumerate(unique_chars_list):
-        cl_folder = folder + f'cluster_{str(cl).zfill(fill_length)}/'
-        os.makedirs(cl_folder, exist_ok=True)
-
-        for unique_char, unique_count_blocks in unique_chars.items():
-            unfrozen = dict(unique_char)
-            tree_holder.count_innovations_fitch(unfrozen)
+def write_characters_table_unbalanced(characters, stats, file_name, parquet=False, logger=None):
+    write_characters_table(((stat[0], char, [f'{i} copies' for i in range(max(char.values(), default=0) + 1)])
+                            for char, stat in zip(characters, stats)), file_name, parquet, logger)
 
-            labels = [f'{i}{"+" if i == len(colors) - 1 else ""} copies'
-                      for i in range(max(unfrozen.values()) + 1)]
-            files = split_filenames(unique_count_blocks)
-            for file in full_filenames(files, '.pdf'):
-                tree_holder.draw(cl_folder + file, legend_labels=labels, show_branch_support=show_branch_support, colors=colors)
\ No newline at end of file
+def write_trees_unbalanced(unique_chars_list, folder, show_branch_support, tree_holder, colors, threads=1,
+                           blocks_to_render=None, **render_params):
+    fill_length = len(str(len(unique_chars_list)))
+    with RenderPool(tree_holder, threads, **render_params) as render_pool:
+        for cl, unique_chars in enumerate(unique_chars_list):
+            cl_folder = folder + f'cluster_{str(cl).zfill(fill_length)}/'
+            if render_params.get('bundle_file') is None: os.makedirs(cl_folder, exist_ok=True)
+
+            unique_chars = [(char, char_blocks) for char, char_blocks in unique_chars.items()
+                            if blocks_to_render is None or any(b in blocks_to_render for b in char_blocks)]
+            unfrozen_chars = [dict(unique_char) for unique_char, _ in unique_chars]
+            colorings = tree_holder.count_innovations_fitch_batch(unfrozen_chars)
+            for unfrozen, (_, unique_count_blocks), _ in zip(unfrozen_chars, unique_chars, colorings):
+                labels = [f'{i}{"+" if i == len(colors) - 1 else ""} copies'
+                          for i in range(max(unfrozen.values()) + 1)]
+                files = split_filenames(unique_count_blocks)
+                for file in full_filenames(files, '.pdf'):
+                    render_pool.draw(cl_folder + file, legend_labels=labels, show_branch_support=show_branch_support,
+                                     colors=colors)
\ No newline at end of file
@@ -5,8 +5,11 @@ import numpy as np
 import csv
 import os
 
+from parebrick.tree.render_pool import RenderPool
+from parebrick.characters.characters_table import write_characters_table
 
-def get_characters_which_chr(blocks_df):
+
+def get_characters_which_chr(block_table):
     def make_label(chrs):
         return 'chromosomes: ' + ', '.join(map(str, sorted(chrs)))
 
@@ -15,11 +18,15 @@ def get_characters_which_chr(blocks_df):
     which_chrs = defaultdict(lambda: defaultdict(list))
     block_lens = defaultdict(list)
 
-    for (block, genome), df_block_genome in blocks_df.groupby(['block', 'species']):
-        which_chrs[block][genome] = df_block_genome.chr.tolist()
-        block_lens[block].extend(df_block_genome.chr_end - df_block_genome.chr_beg)
+    # occurrences sorted by block are already sorted by species inside every block
+    order = block_table.block_order
+    blocks, species = block_table.block[order].tolist(), block_table.species[block_table.species_code[order]]
+    chrs, lengths = block_table.chrs[block_table.chr_code[order]], block_table.lengths()[order].tolist()
+    for block, genome, chromosome, length in zip(blocks, species, chrs, lengths):
+        which_chrs[block][genome].append(chromosome)
+        block_lens[block].append(length)
 
-    for block in sorted(blocks_df.block.unique()):
+    for block in block_table.blocks.tolist():
         used_chroms = set()
         genome_colors = defaultdict(int)
 
@@ -44,9 +51,8 @@ def get_characters_which_chr(blocks_df):
 
 def get_characters_stats_which_chr(characters, tree_holder):
     ans = []
-    for block, multichromo, mean_length, std_length, genome_colors, labels in characters:
-        tree_holder.count_innovations_fitch(genome_colors)
-
+    colorings = tree_holder.count_innovations_fitch_batch([char[4] for char in characters])
+    for (block, multichromo, mean_length, std_length, genome_colors, labels), _ in zip(characters, colorings):
         score_rear, count_rear, count_all_rear = tree_holder.count_parallel_rearrangements(skip_grey=False)
         ans.append([block, multichromo, mean_length, std_length, score_rear, count_rear, count_all_rear, count_all_rear <= 1])
 
@@ -73,10 +79,16 @@ def write_characters_csv_which_chr(characters, folder):
             wtr.writerows(rows)
 
 
-def write_trees_which_chr(characters, folder, show_branch_support, tree_holder, colors):
-    os.makedirs(folder, exist_ok=True)
+def write_characters_table_which_chr(characters, file_name, parquet=False, logger=None):
+    write_characters_table(((block, genome_colors, labels) for block, _1, _2, _3, genome_colors, labels in characters),
+                           file_name, parquet, logger)
 
-    for i, (block, _1, _2, _3, genome_colors, labels) in enumerate(characters):
-        tree_holder.count_innovations_fitch(genome_colors)
-        tree_holder.draw(folder + f'block_{block}.pdf', legend_labels=labels,
-                         show_branch_support=show_branch_support, colors=colors)
\ No newline at end of file
+
+def write_trees_which_chr(characters, folder, show_branch_support, tree_holder, colors, threads=1, **render_params):
+    if render_params.get('bundle_file') is None: os.makedirs(folder, exist_ok=True)
+
+    colorings = tree_holder.count_innovations_fitch_batch([char[4] for char in characters])
+    with RenderPool(tree_holder, threads, **render_params) as render_pool:
+        for (block, _1, _2, _3, genome_colors, labels), _ in zip(characters, colorings):
+            render_pool.draw(folder + f'block_{block}.pdf', legend_labels=labels,
+                             show_branch_support=show_branch_support, colors=colors)
\ No newline at end of file
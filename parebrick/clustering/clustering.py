@@ -1,9 +1,15 @@
 import numpy as np
 
-from parebrick.clustering.distance_matrices import dist_matrix_similarity, dist_matrix_proximity
+from parebrick.clustering.distance_matrices import dist_matrix_similarity, dist_matrix_proximity, \
+    stats_pairs_indexes, pairs_similarity, pairs_distances_percentiles
 
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from sklearn.cluster import AgglomerativeClustering
 
+CLUSTERING_MODES = ['agglomerative', 'linkage', 'graph']
+
 
 def renew_index(cls):
     used, new_cls_indexes = set(), []
@@ -15,18 +21,53 @@ def renew_index(cls):
     new_index_dict = {cl: i for i, cl in enumerate(new_cls_indexes)}
     return np.array([new_index_dict[cl] for cl in cls])
 
-def clustering(characters, stats, distance_between_blocks, max_length, threshold, j, b, proximity_percentile, logger):
-    J = dist_matrix_similarity(characters)
+# Only pairs of blocks from distances between blocks are connected, clusters are components of graph
+# with edges shorter than threshold (single linkage). Similarity is scaled by its maximum among edges,
+# proximity is scaled by maximal length as all other pairs are considered to be at this distance.
+def graph_clustering(characters, stats, distance_between_blocks, max_length, threshold, j, b, proximity_percentile):
+    in_stats, i1, i2 = stats_pairs_indexes(stats, distance_between_blocks.pairs)
+
+    J = pairs_similarity(characters, i1, i2)
+    if len(J) > 0 and J.max() != 0: J /= J.max()
+    B = pairs_distances_percentiles(distance_between_blocks, proximity_percentile)[in_stats] / max_length
+
+    close = J * j + B * b < threshold
+    graph = coo_matrix((np.ones(close.sum()), (i1[close], i2[close])), shape=(len(stats), len(stats)))
+    return connected_components(graph, directed=False)[1]
+
+
+def clustering(characters, stats, distance_between_blocks, max_length, threshold, j, b, proximity_percentile, logger,
+               mode='agglomerative'):
+    if mode == 'graph':
+        cls = graph_clustering(characters, stats, distance_between_blocks, max_length, threshold, j, b,
+                               proximity_percentile)
+        logger.info('Clustring is done')
+        return renew_index(cls)
+
+    # linkage works with condensed matrices of upper triangle taking half of memory of dense ones, they are kept
+    # in float64 as linkage converts them anyway and rounding of distances close to threshold could change clusters
+    condensed = mode == 'linkage'
+
+    J = dist_matrix_similarity(characters, condensed)
     if J.max() != 0: J /= J.max()
     logger.info('Jaccard index matrix constructed')
 
-    B = dist_matrix_proximity(stats, distance_between_blocks, max_length, proximity_percentile)
+    B = dist_matrix_proximity(stats, distance_between_blocks, max_length, proximity_percentile, condensed)
     B /= B.max()
     logger.info('Proximity matrix constructed')
 
-    D = J * j + B * b
-    cls = AgglomerativeClustering(n_clusters=None, metric='precomputed', linkage='average',
-                                  distance_threshold=threshold).fit_predict(D)
+    J *= j
+    B *= b
+    D = J
+    D += B
+    del B
+
+    if condensed:
+        # clusters are not merged at distance equal to threshold, as in agglomerative clustering
+        cls = fcluster(linkage(D, method='average'), np.nextafter(threshold, 0), criterion='distance')
+    else:
+        cls = AgglomerativeClustering(n_clusters=None, metric='precomputed', linkage='average',
+                                      distance_threshold=threshold).fit_predict(D)
 
     logger.info('Clustring is done')
 
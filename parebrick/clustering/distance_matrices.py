@@ -1,28 +1,116 @@
 import numpy as np
+import pandas as pd
 
+from scipy.spatial.distance import cdist
 
-def dist_matrix_similarity(characters):
-    n = len(characters)
-    arr = np.zeros((n, n))
-    for i1, char1 in enumerate(characters):
-        for i2, char2 in enumerate(characters):
-            if i1 >= i2: continue
-            arr[i1, i2] = arr[i2, i1] = \
-                sum(abs(char1[genome] - char2[genome]) for genome in char1.keys() | char2.keys())
+# limit for cells of distance matrix computed at once
+DISTANCES_CHUNK_CELLS = 2 ** 24
 
+
+# characters x genomes matrix of character states, genomes absent in character have state 0
+def characters_matrix(characters):
+    return pd.DataFrame.from_records(characters).fillna(0).to_numpy(dtype=np.float64)
+
+
+def condensed_index(i, n):
+    return i * n - i * (i + 1) // 2
+
+
+# distances are counted to distinct characters only and then spread to all characters with the same states
+def dist_matrix_similarity(characters, condensed=False, dtype=np.float64):
+    xs = characters_matrix(characters)
+    n = len(xs)
+    if n > 0:
+        xs, inverse = np.unique(xs, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+    chunk = max(1, DISTANCES_CHUNK_CELLS // max(1, n, len(xs)))
+
+    def rows_distances(start, end):
+        return cdist(xs[inverse[start:end]], xs, 'cityblock')[:, inverse]
+
+    if not condensed:
+        arr = np.zeros((n, n), dtype=dtype)
+        for start in range(0, n, chunk):
+            arr[start:start + chunk] = rows_distances(start, start + chunk)
+        return arr
+
+    # condensed form contains only upper triangle of matrix by rows, as scipy.spatial.distance.squareform gives
+    arr = np.zeros(n * (n - 1) // 2, dtype=dtype)
+    for start in range(0, n, chunk):
+        ds = rows_distances(start, start + chunk)
+        for k, i in enumerate(range(start, min(n, start + chunk))):
+            arr[condensed_index(i, n):condensed_index(i + 1, n)] = ds[k, i + 1:]
     return arr
 
 
-def dist_matrix_proximity(stats, distance_between_blocks, max_length, percentile):
+# linear interpolation between neighbour values the same as in np.percentile
+def sorted_rows_percentile(xs, counts, percentile):
+    virtual = (counts - 1) * (percentile / 100)
+    below = np.floor(virtual).astype(np.int64)
+    above = np.minimum(below + 1, counts - 1)
+    t = virtual - below
+
+    rows = np.arange(len(xs))
+    a, b = xs[rows, below], xs[rows, above]
+    diff_b_a = b - a
+    return np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
+
+
+# percentile of distances between blocks of every pair, distances of pairs are put to pairs x strains matrix
+# with nans for strains where blocks are not located on the same chromosome;
+# rows are sorted with nans at the end instead of np.nanpercentile, which goes through rows one by one
+def pairs_distances_percentiles(distance_between_blocks, percentile):
+    pairs_count, strains_count = len(distance_between_blocks), len(distance_between_blocks.strains)
+    offsets = distance_between_blocks.offsets
+    counts = np.diff(offsets)
+    rows = np.repeat(np.arange(pairs_count), counts)
+
+    percentiles = np.zeros(pairs_count)
+    chunk = max(1, DISTANCES_CHUNK_CELLS // max(1, strains_count))
+    for start in range(0, pairs_count, chunk):
+        end = min(pairs_count, start + chunk)
+        ds = np.full((end - start, strains_count), np.nan)
+        occurrences = slice(offsets[start], offsets[end])
+        ds[rows[occurrences] - start, distance_between_blocks.strain_codes[occurrences]] = \
+            distance_between_blocks.distances[occurrences]
+        percentiles[start:end] = sorted_rows_percentile(np.sort(ds, axis=1), counts[start:end], percentile)
+
+    return percentiles
+
+
+# indexes in stats of blocks of every pair, pairs with other blocks are marked as not in stats
+def stats_pairs_indexes(stats, pairs):
+    blocks = np.array([stat[0] for stat in stats], dtype=np.int64)
+    n = len(blocks)
+
+    order = np.argsort(blocks)
+    pairs = pairs.reshape(-1, 2)
+    positions = np.minimum(np.searchsorted(blocks[order], pairs), max(0, n - 1))
+    in_stats = (blocks[order][positions] == pairs).all(axis=1) if n > 0 else np.zeros(len(pairs), dtype=bool)
+
+    i1, i2 = order[positions[in_stats]].reshape(-1, 2).T
+    return in_stats, i1, i2
+
+
+def pairs_similarity(characters, i1, i2):
+    xs = characters_matrix(characters)
+    chunk = max(1, DISTANCES_CHUNK_CELLS // max(1, xs.shape[1]))
+    return np.concatenate([np.abs(xs[i1[start:start + chunk]] - xs[i2[start:start + chunk]]).sum(axis=1)
+                           for start in range(0, len(i1), chunk)] + [np.zeros(0)])
+
+
+def dist_matrix_proximity(stats, distance_between_blocks, max_length, percentile, condensed=False, dtype=np.float64):
     n = len(stats)
-    arr = np.zeros((n, n))
-    for i1, stats1 in enumerate(stats):
-        for i2, stats2 in enumerate(stats):
-            block1, block2 = stats1[0], stats2[0]
-            if i1 >= i2: continue
-            b1, b2 = block1, block2
-            if b1 > b2: b1, b2 = b2, b1
-            ds = distance_between_blocks[(b1, b2)].values()
-            arr[i1, i2] = arr[i2, i1] = np.percentile(list(ds), percentile) if len(ds) > 0 else max_length
+    in_stats, i1, i2 = stats_pairs_indexes(stats, distance_between_blocks.pairs)
+    percentiles = pairs_distances_percentiles(distance_between_blocks, percentile)[in_stats]
+
+    if not condensed:
+        arr = np.full((n, n), max_length, dtype=dtype)
+        np.fill_diagonal(arr, 0)
+        arr[i1, i2] = arr[i2, i1] = percentiles
+        return arr
 
+    arr = np.full(n * (n - 1) // 2, max_length, dtype=dtype)
+    i1, i2 = np.minimum(i1, i2), np.maximum(i1, i2)
+    arr[condensed_index(i1, n) + i2 - i1 - 1] = percentiles
     return arr
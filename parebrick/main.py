@@ -13,26 +13,29 @@ from itertools import takewhile
 from operator import itemgetter
 
 from parebrick.characters.balanced import get_characters_balanced, write_characters_csv_balanced, get_characters_stats_balanced, \
-    write_trees_balanced, write_stats_csv_balanced
+    write_trees_balanced, write_stats_csv_balanced, write_characters_table_balanced
 from parebrick.characters.unbalanced import get_characters_stats_unbalanced, write_stats_csv_unbalanced, \
-    write_characters_csv_unbalanced, call_unique_characters, write_trees_unbalanced
+    write_characters_csv_unbalanced, call_unique_characters, write_trees_unbalanced, write_characters_table_unbalanced
 from parebrick.characters.neighbours import write_trees_neightbours
 from parebrick.characters.which_chromosome import get_characters_which_chr, get_characters_stats_which_chr, \
-    write_stats_csv_which_chr, write_characters_csv_which_chr, write_trees_which_chr
+    write_stats_csv_which_chr, write_characters_csv_which_chr, write_trees_which_chr, write_characters_table_which_chr
 
-from parebrick.clustering.clustering import clustering, split_by_cluster
+from parebrick.clustering.clustering import clustering, split_by_cluster, CLUSTERING_MODES
 
-from parebrick.utils.data.converters import block_coords_to_infercars
-from parebrick.utils.data.parsers import genome_lengths_from_block_coords, parse_infercars_to_df, \
+from parebrick.utils.data.parsers import genome_lengths_from_block_coords, parse_block_coords_to_df, \
     get_genomes_contain_blocks_grimm, make_labels_dict, get_block_neighbours, export_df_to_infercars, \
-    genome_genome_lengths_from_chromosomes_lengths
-from parebrick.utils.data.unique_gene_filters import grimm_filter_unique_gene, filter_dataframe_unique, \
-    filter_dataframe_allowed
-from parebrick.utils.data.stats import distance_between_blocks_dict, check_stats_stains, get_mean_coverage
+    genome_genome_lengths_from_chromosomes_lengths, parse_grimm, BlockTable
+from parebrick.utils.data.unique_gene_filters import grimm_filter_unique_gene, filter_dataframe_unique
+from parebrick.utils.data.stats import distances_between_blocks, check_stats_stains, get_mean_coverage, \
+    genome_neighbour_pairs
+from parebrick.utils.data.incremental import characters_changes, write_changes_csv
 
-from parebrick.utils.decorators import decorate
+from parebrick.utils.decorators import decorate, metrics
+from parebrick.utils.cache import StageCache, dump_pickle, load_pickle
 
 from parebrick.tree.tree_holder import TreeHolder
+from parebrick.tree.bundle import copy_viewer
+from parebrick.tree.svg_renderer import SvgRenderer, svg_to_pdf_available
 
 logger = logging.getLogger()
 
@@ -58,13 +61,40 @@ def restricted_float(x):
     return x
 
 
+# number of first characters to render, scores must be sorted in descending order
+def render_limit(scores):
+    limit = len(scores)
+    if render_top is not None:
+        limit = min(limit, render_top)
+    if render_min_score is not None:
+        limit = min(limit, len(list(takewhile(lambda score: score >= render_min_score, scores))))
+
+    if limit < len(scores):
+        logger.info(f'Rendering trees for {limit} of {len(scores)} characters')
+    return limit
+
+
+# parameters of render pool for trees of module: bundle of tree colorings instead of rendered trees with viewer
+# copied next to it, or format of trees and renderer, svg renderer is built once and keeps layout of tree
+def render_params(module_folder):
+    global svg_renderer
+    if trees_format == 'bundle':
+        copy_viewer(module_folder)
+        return {'bundle_file': module_folder + TREES_BUNDLE_FILENAME}
+
+    if use_svg_renderer and svg_renderer is None:
+        svg_renderer = SvgRenderer(tree_holder)
+    return {'renderer': svg_renderer if use_svg_renderer else None, 'extension': '.' + trees_format}
+
+
 # argument parsing
 def initialize():
     global parser, GRIMM_FILENAME, UNIQUE_GRIMM_FILENAME, BLOCKS_COORD_FILENAME, INFERCARS_FILENAME, STATS_FILE, \
         BALANCED_FOLDER, UNBALANCED_FOLDER, CHARACTERS_FOLDER, TREES_FOLDER, BALANCED_COLORS, UNBALANCED_COLORS, \
         clustering_proximity_percentile, clustering_threshold, clustering_j, clustering_j, clustering_b, \
         CSV_BLOCK_FILENAME, CSV_BLOCK_UNIQUE_FILENAME, CSV_GENOME_LENGTH, have_unique, NEIGHBOURS_FOLDER, \
-        INFERCARS_UNIQUE_FILENAME, WHICH_CHR_FOLDER
+        INFERCARS_UNIQUE_FILENAME, WHICH_CHR_FOLDER, CACHE_FOLDER, CHECKPOINTS_FOLDER, CHANGES_FILE, \
+        METRICS_FILE, PROFILES_FOLDER, CHARACTERS_TABLE_FILENAME, TREES_BUNDLE_FILENAME
 
     have_unique = True
 
@@ -114,6 +144,72 @@ def initialize():
                           help='Threshold for algorithm of clustering, default is 0.025.'
                                'Can be increased for getting larger clusters or decreased for getting smaller and more grouped clusters.')
 
+    optional.add_argument('--clustering_mode', '-cm', choices=CLUSTERING_MODES, default='agglomerative',
+                          help='Clustering algorithm in unbalanced module: `agglomerative` uses dense distance '
+                               'matrices, `linkage` uses SciPy on condensed matrices taking half of memory '
+                               '(clusters may differ from agglomerative ones on ties or rounding of distances at '
+                               'threshold), '
+                               '`graph` joins only blocks close to each other in genomes (single linkage) '
+                               'with memory linear in number of characters. Default: agglomerative.')
+
+    optional.add_argument('--clustering_neighbours', '-cn', type=int, default=10,
+                          help='Number of nearest blocks in every genome connected with block in `graph` clustering '
+                               'mode. Default: 10.')
+
+    optional.add_argument('--threads', '-p', type=int, default=1,
+                          help='Number of processes used for getting balanced rearrangements characters from '
+                               'components of breakpoint graph and for rendering trees. Default: 1.')
+
+    optional.add_argument('--render_top', '-rt', type=int, default=None,
+                          help='Render trees only for this number of characters with the highest parallel '
+                               'rearrangements score in each module. Default: all characters.')
+
+    optional.add_argument('--render_min_score', '-rs', type=float, default=None,
+                          help='Render trees only for characters with parallel rearrangements score not less than '
+                               'this value. Default: all characters.')
+
+    optional.add_argument('--write_infercars', '-wi', type=str2bool, default=True,
+                          help='Write blocks in infercars format to preprocessed data folder. Default: True.')
+
+    stages = [name for name, _, _, _ in PIPELINE_STAGES]
+    optional.add_argument('--resume', '-rm', type=str2bool, default=False, const=True, nargs='?',
+                          help='Continue previous run in the output folder: stages with saved checkpoints are not '
+                               'run again. Default: False.')
+    optional.add_argument('--from_stage', '-fs', choices=stages, default=None,
+                          help='Run pipeline from this stage, previous stages are loaded from checkpoints of previous '
+                               'run in the output folder.')
+    optional.add_argument('--only_stage', '-os', choices=stages, default=None,
+                          help='Run only this stage, previous stages are loaded from checkpoints of previous '
+                               'run in the output folder.')
+
+    optional.add_argument('--cache', '-ca', type=str2bool, default=True,
+                          help='Keep parsed input data and balanced characters in cache folder inside output folder '
+                               'and reuse them in next runs with the same input files and parameters. Default: True.')
+
+    optional.add_argument('--characters_files', '-cf', type=str2bool, default=False, const=True, nargs='?',
+                          help='Also write every character to its own csv file in characters folder of every module, '
+                               'as in earlier versions. Default: False.')
+    optional.add_argument('--parquet', '-pq', type=str2bool, default=False, const=True, nargs='?',
+                          help='Also write characters tables in parquet format, requires pyarrow or fastparquet. '
+                               'Default: False.')
+
+    optional.add_argument('--trees_format', '-tf', choices=['pdf', 'svg', 'bundle'], default='pdf',
+                          help='Format of tree colorings: `pdf` and `svg` render every tree, `bundle` writes colorings '
+                               'of all characters of module to one tree_colorings.json.gz file for viewer.html '
+                               'without rendering. Default: pdf.')
+    optional.add_argument('--svg_renderer', '-sr', type=str2bool, default=False, const=True, nargs='?',
+                          help='Render trees with lightweight svg renderer instead of ete3, trees in pdf format are '
+                               'converted from svg and require cairosvg. Default: False.')
+
+    optional.add_argument('--profile', '-pf', type=str2bool, default=False, const=True, nargs='?',
+                          help='Profile every stage with cProfile, profiles are written to profiles folder inside '
+                               'output folder. Default: False.')
+
+    optional.add_argument('--previous_run', '-pr', default=None,
+                          help='Output folder of previous run on the same blocks without some of genomes. Characters '
+                               'changed since previous run are written to changed_characters.csv, the whole pipeline '
+                               'is run again.')
+
     clustering_proximity_percentile = 25
 
     GRIMM_FILENAME = 'genomes_permutations.txt'
@@ -134,7 +230,15 @@ def initialize():
     WHICH_CHR_FOLDER = 'which_chromosome_output/'
 
     CHARACTERS_FOLDER = 'characters/'
+    # without extension, written as .csv and .parquet
+    CHARACTERS_TABLE_FILENAME = 'characters'
     TREES_FOLDER = 'tree_colorings/'
+    TREES_BUNDLE_FILENAME = 'tree_colorings.json.gz'
+    CACHE_FOLDER = 'cache/'
+    CHECKPOINTS_FOLDER = 'checkpoints/'
+    CHANGES_FILE = 'changed_characters.csv'
+    METRICS_FILE = 'run_metrics.json'
+    PROFILES_FOLDER = 'profiles/'
 
     BALANCED_COLORS = ['White', 'Gainsboro', 'DimGray', 'LightGreen', 'LightBlue', 'NavajoWhite', 'LightPink',
                        'DarkSeaGreen', 'Orchid', 'Navy', 'Olive', 'Teal', 'SaddleBrown', 'SeaGreen', 'DarkCyan',
@@ -146,13 +250,39 @@ def initialize():
 # This module converts data from the output data format
 # of Sibelia or Ragout scripts into the infercars format to simplify the subsequent annotation.
 # Also filtering blocks in the grimm format for unique single-copy blocks for the breakpoint graph construction.
+# Grimm file is parsed only once, all next modules use parsed permutations.
+# Parsed data is cached by hashes of input files, so runs with other parameters of next modules skip parsing.
 @decorate("Preprocess Data", logger)
 def preprocess_data():
-    global unique_blocks, balanced_block_rate
-    unique_blocks = grimm_filter_unique_gene(blocks_folder + GRIMM_FILENAME,
-                                             preprocessed_data_folder + UNIQUE_GRIMM_FILENAME, balanced_block_rate)
-    logger.info('Converting block coords to infercars format')
-    block_coords_to_infercars(blocks_folder + BLOCKS_COORD_FILENAME, preprocessed_data_folder + INFERCARS_FILENAME)
+    global unique_blocks, balanced_block_rate, permutations, unique_permutations, blocks_df, neighbours, \
+        all_genomes, blocks, block_genome_count
+    input_files = [blocks_folder + GRIMM_FILENAME, blocks_folder + BLOCKS_COORD_FILENAME]
+    key = cache.key('Preprocessed data', input_files, balanced_block_rate=balanced_block_rate)
+    cached = cache.load('Preprocessed data', key)
+
+    if cached is None:
+        permutations = parse_grimm(blocks_folder + GRIMM_FILENAME)
+        neighbours = get_block_neighbours(permutations)
+        all_genomes, blocks, block_genome_count = get_genomes_contain_blocks_grimm(permutations)
+
+        unique_blocks, unique_permutations = grimm_filter_unique_gene(
+            permutations, preprocessed_data_folder + UNIQUE_GRIMM_FILENAME, balanced_block_rate)
+
+        blocks_df = parse_block_coords_to_df(blocks_folder + BLOCKS_COORD_FILENAME)
+
+        cache.save('Preprocessed data', key, (permutations, unique_blocks, unique_permutations, blocks_df, neighbours,
+                                              all_genomes, blocks, block_genome_count))
+    else:
+        permutations, unique_blocks, unique_permutations, blocks_df, neighbours, all_genomes, blocks, \
+            block_genome_count = cached
+        unique_permutations.write_grimm(preprocessed_data_folder + UNIQUE_GRIMM_FILENAME)
+
+    metrics.count('genomes', len(all_genomes))
+    metrics.count('blocks', len(blocks))
+
+    if write_infercars:
+        logger.info('Converting block coords to infercars format')
+        export_df_to_infercars(blocks_df, preprocessed_data_folder + INFERCARS_FILENAME, sort_blocks=False)
 
 
 # In this module, parsing of input blocks and their coordinates, as well as a phylogenetic, takes place.
@@ -162,22 +292,23 @@ def preprocess_data():
 # is checked, if necessary, the missing strains are discarded.
 @decorate("Parsers and check strains", logger)
 def parsers_and_stats():
-    global chr_lengths, blocks_df, tree_holder, genomes, blocks, block_genome_count, have_unique, unique_blocks, \
-        neighbours
+    global chr_lengths, blocks_df, block_table, tree_holder, genomes, have_unique, unique_blocks
 
     chr_lengths = genome_lengths_from_block_coords(blocks_folder + BLOCKS_COORD_FILENAME)
     genome_lengths = genome_genome_lengths_from_chromosomes_lengths(chr_lengths)
 
-    blocks_df = parse_infercars_to_df(preprocessed_data_folder + INFERCARS_FILENAME)
+    # all next computations on blocks coords use the same columnar table
+    block_table = BlockTable.from_df(blocks_df)
+
     unique_blocks_df = filter_dataframe_unique(blocks_df)
-    filted_blocks_df = filter_dataframe_allowed(blocks_df, unique_blocks)
-    neighbours = get_block_neighbours(blocks_folder + GRIMM_FILENAME)
+    unique_table = block_table.select_blocks(unique_blocks_df['block'].unique())
+    filted_table = block_table.select_blocks(unique_blocks)
 
-    if len(filted_blocks_df) == 0:
+    if len(filted_table) == 0:
         have_unique = False
         logger.warning('No unique one-copy blocks found. Balanced rearrangements will not be called')
 
-    export_df_to_infercars(unique_blocks_df, preprocessed_data_folder + INFERCARS_UNIQUE_FILENAME)
+    if write_infercars: export_df_to_infercars(unique_blocks_df, preprocessed_data_folder + INFERCARS_UNIQUE_FILENAME)
     blocks_df.to_csv(preprocessed_data_folder + CSV_BLOCK_FILENAME, index=False)
     unique_blocks_df.to_csv(preprocessed_data_folder + CSV_BLOCK_UNIQUE_FILENAME, index=False)
     with open(preprocessed_data_folder + CSV_GENOME_LENGTH, 'w') as f:
@@ -185,20 +316,18 @@ def parsers_and_stats():
         w.writerow(['Genome', 'Length'])
         w.writerows(genome_lengths.items())
 
-    logger.info(f'Blocks count: {len(blocks_df["block"].unique())}')
-    logger.info(f'Unique one-copy blocks count: {len(unique_blocks_df["block"].unique())}')
+    logger.info(f'Blocks count: {len(block_table.blocks)}')
+    logger.info(f'Unique one-copy blocks count: {len(unique_table.blocks)}')
 
-    logger.info(f'Mean block coverage: {get_mean_coverage(blocks_df, genome_lengths) * 100} %')
+    logger.info(f'Mean block coverage: {get_mean_coverage(block_table, genome_lengths) * 100} %')
     logger.info(f'Mean common one-copy blocks coverage: '
-                f'{get_mean_coverage(unique_blocks_df, genome_lengths) * 100 if have_unique else 0} %')
+                f'{get_mean_coverage(unique_table, genome_lengths) * 100 if have_unique else 0} %')
     logger.info(f'Mean {balanced_block_rate} % rate one-copy blocks coverage: '
-                f'{get_mean_coverage(filted_blocks_df, genome_lengths) * 100 if have_unique else 0} %')
+                f'{get_mean_coverage(filted_table, genome_lengths) * 100 if have_unique else 0} %')
 
     tree_holder = TreeHolder(tree_file, logger, labels_dict=make_labels_dict(labels_file))
 
-    genomes, blocks, block_genome_count = get_genomes_contain_blocks_grimm(blocks_folder + GRIMM_FILENAME)
-
-    genomes = check_stats_stains(tree_holder, set(genomes), logger)
+    genomes = check_stats_stains(tree_holder, set(all_genomes), logger)
 
 
 # In this module, the breakpoint of the graph is built using the bg library,
@@ -206,7 +335,14 @@ def parsers_and_stats():
 @decorate("Balanced rearrangements characters", logger)
 def balanced_rearrangements_characters():
     global b_characters
-    b_characters = get_characters_balanced(preprocessed_data_folder + UNIQUE_GRIMM_FILENAME, genomes, logger)
+    key = cache.key('Balanced characters', [blocks_folder + GRIMM_FILENAME], balanced_block_rate=balanced_block_rate,
+                    genomes=sorted(genomes))
+    b_characters = cache.load('Balanced characters', key)
+
+    if b_characters is None:
+        b_characters = get_characters_balanced(unique_permutations, genomes, logger, threads)
+        cache.save('Balanced characters', key, b_characters)
+    metrics.count('characters', len(b_characters))
 
 
 # This module implements balanced rearrangements characters statistics calculation
@@ -217,8 +353,11 @@ def balanced_rearrangements_stats():
     global b_characters, b_stats, keep_consistent
 
     logger.info('Counting distances between unique one-copy blocks, may take a while')
-    distance_between_uniq_blocks = distance_between_blocks_dict(blocks_df, chr_lengths, unique_blocks)
+    distance_between_uniq_blocks = distances_between_blocks(block_table, chr_lengths,
+                                                            pairs=[(int(v1[:-1]), int(v2[:-1]))
+                                                                   for v1, v2, _, _ in b_characters])
     b_stats = get_characters_stats_balanced(b_characters, tree_holder, distance_between_uniq_blocks)
+    metrics.count('characters', len(b_characters))
     char_stats = zip(b_characters, b_stats)
 
     logger.info(f'Got characters after breakpoint graph consideration: {len(b_characters)}')
@@ -246,16 +385,22 @@ def balanced_rearrangements_stats():
 @decorate("Balanced rearrangements output", logger)
 def balanced_rearrangements_output():
     balanced_folder = output_folder + BALANCED_FOLDER
+    shutil.rmtree(balanced_folder, ignore_errors=True)
     os.makedirs(balanced_folder, exist_ok=True)
 
     stats_file = balanced_folder + STATS_FILE
     write_stats_csv_balanced(b_stats, stats_file)
 
-    characters_folder = balanced_folder + CHARACTERS_FOLDER
-    write_characters_csv_balanced(b_characters, characters_folder)
+    write_characters_table_balanced(b_characters, balanced_folder + CHARACTERS_TABLE_FILENAME, write_parquet, logger)
+    if characters_files: write_characters_csv_balanced(b_characters, balanced_folder + CHARACTERS_FOLDER)
 
     trees_folder = balanced_folder + TREES_FOLDER
-    write_trees_balanced(b_characters, trees_folder, show_branch_support, tree_holder, BALANCED_COLORS)
+    limit = render_limit([stat[2] for stat in b_stats])
+    write_trees_balanced(b_characters, trees_folder, show_branch_support, tree_holder, BALANCED_COLORS, threads, limit,
+                         **render_params(balanced_folder))
+
+    metrics.count('characters', len(b_characters))
+    metrics.count('characters_to_render', limit)
 
 
 # In this module, the mapping of blocks by its number for each strain is performed.
@@ -264,6 +409,7 @@ def unbalanced_rearrangements_characters():
     global ub_characters
     ub_characters = [{genome: block_genome_count[block][genome] for genome in genomes}
                      for block in blocks]
+    metrics.count('characters', len(ub_characters))
 
 
 # This module implements balanced rearrangements characters statistics calculation
@@ -274,6 +420,7 @@ def unbalanced_rearrangements_characters():
 def unbalanced_rearrangements_stats_and_clustering():
     global ub_cls, ub_characters, ub_stats
     ub_stats = get_characters_stats_unbalanced(blocks, ub_characters, tree_holder)
+    metrics.count('characters', len(ub_characters))
 
     char_stats = zip(ub_characters, ub_stats)
     logger.info(f'Got characters after copy number variation consideration: {len(blocks)}')
@@ -297,14 +444,21 @@ def unbalanced_rearrangements_stats_and_clustering():
         return
     logger.info('Counting distances between non-convex character blocks, may take a while')
     if len(ub_stats) > 1:
-        distance_between_blocks = distance_between_blocks_dict(blocks_df, chr_lengths,
-                                                               set(map(itemgetter(0), ub_stats)))
+        ub_blocks = set(map(itemgetter(0), ub_stats))
+        if clustering_mode == 'graph':
+            # distances only between blocks close to each other in genomes
+            distance_between_blocks = distances_between_blocks(
+                block_table, chr_lengths, pairs=genome_neighbour_pairs(block_table, ub_blocks, clustering_neighbours))
+        else:
+            distance_between_blocks = distances_between_blocks(block_table, chr_lengths, ub_blocks)
         ub_cls = clustering(ub_characters, ub_stats, distance_between_blocks, max(chr_lengths.values()),
-                            clustering_threshold, clustering_j, clustering_b, clustering_proximity_percentile, logger)
+                            clustering_threshold, clustering_j, clustering_b, clustering_proximity_percentile, logger,
+                            clustering_mode)
     else:
         ub_cls = np.array([0])
 
     logger.info(f'Clusters: {np.unique(ub_cls).shape[0]}')
+    metrics.count('clustered_characters', len(ub_stats))
 
 
 # In this module, the output of the method files is generated: the file stats.csv with the statistics of unbalanced
@@ -316,41 +470,53 @@ def unbalanced_rearrangements_stats_and_clustering():
 @decorate('Unbalanced rearrangements output', logger)
 def unbalanced_rearrangements_output():
     unbalanced_folder = output_folder + UNBALANCED_FOLDER
+    shutil.rmtree(unbalanced_folder, ignore_errors=True)
     os.makedirs(unbalanced_folder, exist_ok=True)
 
     stats_file = unbalanced_folder + STATS_FILE
     write_stats_csv_unbalanced(ub_stats, ub_cls, stats_file)
 
-    characters_folder = unbalanced_folder + CHARACTERS_FOLDER
-
     cls_chars, cls_stats = split_by_cluster(ub_characters, ub_stats, ub_cls)
     unique_chars_list = call_unique_characters(cls_chars, cls_stats)
 
-    write_characters_csv_unbalanced(unique_chars_list, characters_folder)
+    write_characters_table_unbalanced(ub_characters, ub_stats, unbalanced_folder + CHARACTERS_TABLE_FILENAME,
+                                      write_parquet, logger)
+    if characters_files: write_characters_csv_unbalanced(unique_chars_list, unbalanced_folder + CHARACTERS_FOLDER)
 
     trees_folder = unbalanced_folder + TREES_FOLDER
-    write_trees_unbalanced(unique_chars_list, trees_folder, show_branch_support, tree_holder, UNBALANCED_COLORS)
+    blocks_to_render = set(stat[0] for stat in ub_stats[:render_limit([stat[1] for stat in ub_stats])])
+    write_trees_unbalanced(unique_chars_list, trees_folder, show_branch_support, tree_holder, UNBALANCED_COLORS,
+                           threads, blocks_to_render, **render_params(unbalanced_folder))
+
+    metrics.count('characters', len(ub_characters))
+    metrics.count('characters_to_render', len(blocks_to_render))
 
 
 @decorate('Visualize neighbours output', logger)
 def neighbours_output():
     neighbours_folder = output_folder + NEIGHBOURS_FOLDER
+    shutil.rmtree(neighbours_folder, ignore_errors=True)
     os.makedirs(neighbours_folder, exist_ok=True)
 
-    write_trees_neightbours([s[0] for s in ub_stats], ub_characters, neighbours, neighbours_folder, show_branch_support,
-                            tree_holder, UNBALANCED_COLORS)
+    limit = render_limit([s[1] for s in ub_stats])
+    write_trees_neightbours([s[0] for s in ub_stats[:limit]], ub_characters[:limit], neighbours, neighbours_folder,
+                            show_branch_support, tree_holder, UNBALANCED_COLORS, threads,
+                            **render_params(neighbours_folder))
+    metrics.count('characters_to_render', limit)
 
 
 @decorate("Which chromosome characters", logger)
 def which_chromosome_characters():
     global chr_characters
-    chr_characters = get_characters_which_chr(blocks_df)
+    chr_characters = get_characters_which_chr(block_table)
+    metrics.count('characters', len(chr_characters))
 
 
 @decorate("Which chromosome stats and clustering", logger)
 def which_chromosome_stats_and_clustering():
     global chr_cls, chr_characters, chr_stats
     chr_stats = get_characters_stats_which_chr(chr_characters, tree_holder)
+    metrics.count('characters', len(chr_characters))
 
     char_stats = zip(chr_characters, chr_stats)
     logger.info(f'Got characters after which chromosome consideration: {len(blocks)}')
@@ -372,17 +538,131 @@ def which_chromosome_stats_and_clustering():
 @decorate('Which chromosome output', logger)
 def which_chromosome_output():
     chr_folder = output_folder + WHICH_CHR_FOLDER
+    shutil.rmtree(chr_folder, ignore_errors=True)
     os.makedirs(chr_folder, exist_ok=True)
 
     stats_file = chr_folder + STATS_FILE
     write_stats_csv_which_chr(chr_stats, stats_file)
 
-    characters_folder = chr_folder + CHARACTERS_FOLDER
-
-    write_characters_csv_which_chr(chr_characters, characters_folder)
+    write_characters_table_which_chr(chr_characters, chr_folder + CHARACTERS_TABLE_FILENAME, write_parquet, logger)
+    if characters_files: write_characters_csv_which_chr(chr_characters, chr_folder + CHARACTERS_FOLDER)
 
     trees_folder = chr_folder + TREES_FOLDER
-    write_trees_which_chr(chr_characters, trees_folder, show_branch_support, tree_holder, UNBALANCED_COLORS)
+    limit = render_limit([stat[4] for stat in chr_stats])
+    write_trees_which_chr(chr_characters[:limit], trees_folder, show_branch_support, tree_holder, UNBALANCED_COLORS,
+                          threads, **render_params(chr_folder))
+
+    metrics.count('characters', len(chr_characters))
+    metrics.count('characters_to_render', limit)
+
+
+# Characters of every module are compared with characters of the previous run, new, removed and changed ones
+# are written to one file.
+@decorate('Changed characters output', logger)
+def changes_output():
+    def balanced(characters, stats):
+        return {f'{v1}-{v2}': ({strain: labels[color] for strain, color in genome_colors.items()}, stat[2])
+                for (v1, v2, genome_colors, labels), stat in zip(characters, stats)}
+
+    def unbalanced(characters, stats):
+        return {stat[0]: (genome_colors, stat[1]) for genome_colors, stat in zip(characters, stats)}
+
+    def which_chr(characters, stats):
+        return {stat[0]: ({strain: char[5][color] for strain, color in char[4].items()}, stat[4])
+                for char, stat in zip(characters, stats)}
+
+    rows = []
+    for module, stage, variables, module_characters in [
+        ('balanced', 'balanced_stats', ('b_characters', 'b_stats'), balanced),
+        ('unbalanced', 'unbalanced_stats', ('ub_characters', 'ub_stats'), unbalanced),
+        ('which_chr', 'which_chr_stats', ('chr_characters', 'chr_stats'), which_chr)]:
+        if stage not in previous_state or not all(name in globals() for name in variables): continue
+
+        previous = module_characters(*(previous_state[stage][name] for name in variables))
+        current = module_characters(*(globals()[name] for name in variables))
+        module_rows = characters_changes(module, previous, current)
+        logger.info(f'Changed characters since previous run ({module}): {len(module_rows)}')
+        rows += module_rows
+
+    write_changes_csv(rows, output_folder + CHANGES_FILE)
+    metrics.count('changed_characters', len(rows))
+
+
+# Stages of pipeline in running order: name, function, condition to run it and names of global variables
+# with its results. After every stage these variables are saved to checkpoint, so run can be continued from any stage.
+PIPELINE_STAGES = [
+    ('preprocess', preprocess_data, lambda: True,
+     ['permutations', 'unique_blocks', 'unique_permutations', 'blocks_df', 'neighbours', 'all_genomes', 'blocks',
+      'block_genome_count']),
+    ('parsers', parsers_and_stats, lambda: True,
+     ['chr_lengths', 'block_table', 'tree_holder', 'genomes', 'have_unique']),
+    ('balanced_characters', balanced_rearrangements_characters, lambda: have_unique, ['b_characters']),
+    ('balanced_stats', balanced_rearrangements_stats, lambda: have_unique, ['b_characters', 'b_stats']),
+    ('balanced_output', balanced_rearrangements_output, lambda: have_unique, []),
+    ('unbalanced_characters', unbalanced_rearrangements_characters, lambda: True, ['ub_characters']),
+    ('unbalanced_stats', unbalanced_rearrangements_stats_and_clustering, lambda: True,
+     ['ub_characters', 'ub_stats', 'ub_cls']),
+    ('unbalanced_output', unbalanced_rearrangements_output, lambda: len(ub_stats) != 0, []),
+    ('which_chr_characters', which_chromosome_characters, lambda: which_chr_flag, ['chr_characters']),
+    ('which_chr_stats', which_chromosome_stats_and_clustering, lambda: which_chr_flag,
+     ['chr_characters', 'chr_stats']),
+    ('which_chr_output', which_chromosome_output, lambda: which_chr_flag, []),
+    ('neighbours_output', neighbours_output, lambda: visualize_neighbours, []),
+    ('changes_output', changes_output, lambda: previous_state is not None, []),
+]
+
+
+def checkpoint_path(stage):
+    return output_folder + CHECKPOINTS_FOLDER + stage + '.pkl'
+
+
+def save_checkpoint(stage, variables):
+    os.makedirs(output_folder + CHECKPOINTS_FOLDER, exist_ok=True)
+    dump_pickle({name: globals()[name] for name in variables if name in globals()}, checkpoint_path(stage))
+
+
+def load_checkpoint(stage):
+    globals().update(load_pickle(checkpoint_path(stage)))
+    logger.info(f'Results of stage {stage} loaded from checkpoint')
+
+
+# checkpoints of previous run are loaded before output folder is cleaned, so it can be the same folder
+def load_previous_run(folder):
+    if folder is None: return None
+    if folder[-1] != '/': folder += '/'
+
+    state = {}
+    for stage in ['balanced_stats', 'unbalanced_stats', 'which_chr_stats']:
+        path = folder + CHECKPOINTS_FOLDER + stage + '.pkl'
+        if os.path.isfile(path): state[stage] = load_pickle(path)
+
+    if not state:
+        raise ValueError(f'There are no checkpoints of stats stages in {folder + CHECKPOINTS_FOLDER}')
+    return state
+
+
+# stages before first running one are loaded from checkpoints, with resume all stages having checkpoints are loaded
+def run_stages(from_stage=None, only_stage=None, resume=False):
+    names = [name for name, _, _, _ in PIPELINE_STAGES]
+    start = names.index(only_stage or from_stage) if (only_stage or from_stage) else 0
+    running = False
+
+    for i, (name, function, condition, variables) in enumerate(PIPELINE_STAGES):
+        if only_stage and i > start: break
+
+        if not running and (i < start or resume):
+            if os.path.isfile(checkpoint_path(name)):
+                load_checkpoint(name)
+                continue
+            if not condition(): continue
+            if i < start:
+                raise ValueError(f'There is no checkpoint of stage {name} in {output_folder + CHECKPOINTS_FOLDER}, '
+                                 f'run it before stage {names[start]}')
+
+        running = True
+        if not condition(): continue
+        function()
+        save_checkpoint(name, variables)
 
 
 def main():
@@ -398,7 +678,10 @@ def main():
         )
 
     global blocks_folder, output_folder, tree_file, labels_file, preprocessed_data_folder, show_branch_support, \
-        have_unique, keep_consistent, balanced_block_rate, clustering_threshold, clustering_j, clustering_b
+        have_unique, keep_consistent, balanced_block_rate, clustering_threshold, clustering_j, clustering_b, threads, \
+        render_top, render_min_score, write_infercars, use_cache, cache, which_chr_flag, visualize_neighbours, \
+        clustering_mode, clustering_neighbours, previous_state, characters_files, write_parquet, \
+        trees_format, use_svg_renderer, svg_renderer
     initialize()
 
     start_time = time()
@@ -407,39 +690,39 @@ def main():
     visualize_neighbours, clustering_j, clustering_threshold, which_chr_flag = d['blocks_folder'], d['output'], \
            d['tree'], d['labels'], d['show_branch_support'], d['keep_non_parallel'], d['filter_for_balanced'], \
            d['visualize_neighbours'], d['clustering_tree_patterns_coef'], d['clustering_threshold'], d['which_chr']
+    threads, render_top, render_min_score = d['threads'], d['render_top'], d['render_min_score']
+    write_infercars, use_cache = d['write_infercars'], d['cache']
+    clustering_mode, clustering_neighbours = d['clustering_mode'], d['clustering_neighbours']
+    characters_files, write_parquet, trees_format = d['characters_files'], d['parquet'], d['trees_format']
+    use_svg_renderer, svg_renderer = d['svg_renderer'], None
+
+    if use_svg_renderer and trees_format == 'pdf' and not svg_to_pdf_available():
+        parser.error('cairosvg is required for rendering pdf trees with svg renderer, use `--trees_format svg` '
+                     'or install cairosvg')
 
     clustering_b = 1 - clustering_j
 
     # folders
     if blocks_folder[-1] != '/': blocks_folder += '/'
     if output_folder[-1] != '/': output_folder += '/'
-    shutil.rmtree(output_folder, ignore_errors=True)
-    print('Cleaning output folder')
+    previous_state = load_previous_run(d['previous_run'])
+    # cache of previous runs is kept, results of previous run are kept if it is continued
+    continue_run = d['resume'] or d['from_stage'] or d['only_stage']
+    for file in os.listdir(output_folder) if os.path.isdir(output_folder) and not continue_run else []:
+        path = output_folder + file
+        if file == CACHE_FOLDER[:-1]: continue
+        if os.path.isdir(path): shutil.rmtree(path, ignore_errors=True)
+        else: os.remove(path)
+    if not continue_run: print('Cleaning output folder')
 
     preprocessed_data_folder = output_folder + 'preprocessed_data/'
     os.makedirs(preprocessed_data_folder, exist_ok=True)
 
     logger_initialize()
+    metrics.configure(output_folder + METRICS_FILE, output_folder + PROFILES_FOLDER if d['profile'] else None)
+    cache = StageCache(output_folder + CACHE_FOLDER, logger, use_cache)
 
-    preprocess_data()
-    parsers_and_stats()
-
-    if have_unique:
-        balanced_rearrangements_characters()
-        balanced_rearrangements_stats()
-        balanced_rearrangements_output()
-
-    unbalanced_rearrangements_characters()
-    unbalanced_rearrangements_stats_and_clustering()
-    if len(ub_stats) != 0: unbalanced_rearrangements_output()
-
-    if which_chr_flag:
-        which_chromosome_characters()
-        which_chromosome_stats_and_clustering()
-        which_chromosome_output()
-
-    if visualize_neighbours:
-        neighbours_output()
+    run_stages(d['from_stage'], d['only_stage'], d['resume'])
 
     logger.info(f'Total elapsed time: {time() - start_time} seconds')
 
@@ -0,0 +1,160 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+
+from glob import glob
+
+import parebrick.main as pipeline
+
+from parebrick.characters.characters_table import read_characters_table
+from parebrick.characters.neighbours import write_trees_neightbours
+from parebrick.tree.tree_holder import TreeHolder
+from parebrick.utils.data.parsers import make_labels_dict, get_block_neighbours, parse_grimm
+from parebrick.utils.data.stats import check_stats_stains
+
+logger = logging.getLogger()
+
+MODULES = ['balanced', 'unbalanced', 'which_chr', 'neighbours']
+
+
+def character_from_rows(rows):
+    genome_colors, annotations = {}, {}
+    for row in rows:
+        state = int(row['character_state'])
+        genome_colors[row['strain']] = state
+        annotations[state] = row['character_state_annotation']
+
+    labels = [annotations.get(state, '') for state in range(max(annotations) + 1)]
+    return genome_colors, labels
+
+
+def read_character(file):
+    with open(file) as f:
+        return character_from_rows(csv.DictReader(f))
+
+
+def copies_labels(genome_colors, colors):
+    return [f'{i}{"+" if i == len(colors) - 1 else ""} copies' for i in range(max(genome_colors.values()) + 1)]
+
+
+def find_character_files(module_folder, module, character_id):
+    characters_folder = module_folder + pipeline.CHARACTERS_FOLDER
+    if module == 'balanced':
+        return [file for file in glob(characters_folder + 'id_*.csv')
+                if int(os.path.basename(file).split('_')[1]) == character_id]
+    elif module == 'which_chr':
+        return glob(characters_folder + f'block_{character_id}.csv')
+    else:
+        # unbalanced characters are grouped by clusters and can be shared by several blocks
+        return [file for file in glob(characters_folder + 'cluster_*/block*_*.csv')
+                if str(character_id) in os.path.basename(file)[:-4].split('_', 1)[1].split(',')]
+
+
+# trees of characters from characters table are named the same way as in the run, but unbalanced characters
+# sharing the same pattern are rendered to separate files
+def table_pdf_file(module_folder, module, character_id):
+    trees_folder = module_folder + pipeline.TREES_FOLDER
+    with open(module_folder + pipeline.STATS_FILE) as f:
+        stats = list(csv.DictReader(f))
+
+    if module == 'balanced':
+        adjacency = next(row['adjacency'] for row in stats if int(row['id']) == character_id)
+        return trees_folder + f'id_{str(character_id).zfill(len(str(len(stats))))}_edge_{adjacency}.pdf'
+    elif module == 'unbalanced':
+        clusters = {int(row['block']): int(row['cluster']) for row in stats}
+        fill_length = len(str(max(clusters.values()) + 1))
+        return trees_folder + f'cluster_{str(clusters[character_id]).zfill(fill_length)}/block_{character_id}.pdf'
+    else:
+        return trees_folder + f'block_{character_id}.pdf'
+
+
+# characters are taken from characters table of module, or from files of characters if run wrote them
+def find_characters(module_folder, module, character_id, characters_table):
+    if characters_table is not None:
+        if character_id not in characters_table: return []
+        return [(*character_from_rows(characters_table[character_id]),
+                 table_pdf_file(module_folder, module, character_id))]
+
+    return [(*read_character(file), file.replace(pipeline.CHARACTERS_FOLDER, pipeline.TREES_FOLDER)[:-4] + '.pdf')
+            for file in find_character_files(module_folder, module, character_id)]
+
+
+def render_character(tree_holder, genome_colors, labels, pdf_file, module, character_id, results_folder, neighbours,
+                     show_branch_support):
+    if module == 'neighbours':
+        neighbours_folder = results_folder + pipeline.NEIGHBOURS_FOLDER
+        os.makedirs(neighbours_folder, exist_ok=True)
+        write_trees_neightbours([character_id], [genome_colors], neighbours, neighbours_folder, show_branch_support,
+                                tree_holder, pipeline.UNBALANCED_COLORS)
+        logger.info(f'Neighbours of block {character_id} rendered to {neighbours_folder}')
+        return
+
+    os.makedirs(os.path.dirname(pdf_file), exist_ok=True)
+
+    colors = pipeline.BALANCED_COLORS if module == 'balanced' else pipeline.UNBALANCED_COLORS
+    if module == 'unbalanced': labels = copies_labels(genome_colors, colors)
+
+    tree_holder.count_innovations_fitch(genome_colors)
+    tree_holder.draw(pdf_file, legend_labels=labels, show_branch_support=show_branch_support, colors=colors)
+    logger.info(f'Character {character_id} rendered to {pdf_file}')
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler(sys.stdout)])
+    pipeline.initialize()
+
+    parser = argparse.ArgumentParser(
+        description='Renders trees for chosen characters from results of previous PaReBrick run.')
+
+    parser.add_argument('--tree', '-t', required=True, help='Tree in newick format, the same as used in the run.')
+    parser.add_argument('--results', '-r', default='parebrick_output', help='Path to output folder of the run.')
+    parser.add_argument('--module', '-m', choices=MODULES, default='balanced',
+                        help='Module of the characters. Default: balanced.')
+    parser.add_argument('--characters', '-c', type=int, nargs='+', required=True,
+                        help='Ids of characters: id for balanced module, block number for other modules.')
+
+    parser.add_argument('--labels', '-l', default='',
+                        help='Path to csv file with tree labels, must contain two columns: `strain` and `label`.')
+    parser.add_argument('--blocks_folder', '-b', default='',
+                        help='Path to folder with blocks, required for neighbours module.')
+    parser.add_argument('--show_branch_support', '-sbs', type=pipeline.str2bool, default=False, const=True,
+                        nargs='?', help='Show branch support while tree rendering (ete3 parameter). Default: False.')
+
+    d = vars(parser.parse_args())
+    results_folder, module = d['results'], d['module']
+    if results_folder[-1] != '/': results_folder += '/'
+
+    module_folder = results_folder + {'balanced': pipeline.BALANCED_FOLDER,
+                                      'which_chr': pipeline.WHICH_CHR_FOLDER}.get(module, pipeline.UNBALANCED_FOLDER)
+
+    neighbours = None
+    if module == 'neighbours':
+        if not d['blocks_folder']: parser.error('--blocks_folder is required for neighbours module')
+        neighbours = get_block_neighbours(parse_grimm(os.path.join(d['blocks_folder'], pipeline.GRIMM_FILENAME)))
+
+    table_file = module_folder + pipeline.CHARACTERS_TABLE_FILENAME + '.csv'
+    characters_table = read_characters_table(table_file, d['characters']) if os.path.isfile(table_file) else None
+
+    tree_holder = TreeHolder(d['tree'], logger, labels_dict=make_labels_dict(d['labels']))
+    tree_strains = None
+
+    for character_id in d['characters']:
+        characters = find_characters(module_folder, module, character_id, characters_table)
+        if len(characters) == 0:
+            logger.error(f'Character {character_id} is not found in {module_folder}')
+            continue
+
+        for genome_colors, labels, pdf_file in characters[:1] if module == 'neighbours' else characters:
+            # tree is pruned the same way as in the run
+            if tree_strains is None:
+                tree_strains = check_stats_stains(tree_holder, set(genome_colors), logger)
+
+            render_character(tree_holder, genome_colors, labels, pdf_file, module, character_id, results_folder,
+                             neighbours, d['show_branch_support'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import gzip
+import json
+import os
+import shutil
+
+VIEWER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'viewer.html')
+
+
+# Tree colorings of one module in one gzipped json file: tree once as arrays of nodes in postorder
+# (the order of node colors) and node colors, legend labels and colors of every character.
+def write_bundle(file, tree_holder, characters):
+    bundle = {'tree': tree_holder.tree_arrays(), 'characters': characters}
+    with gzip.open(file, 'wt') as f:
+        json.dump(bundle, f, separators=(',', ':'))
+
+
+def bundle_character(name, node_colors, legend_labels=(), colors=(), **_):
+    max_color = int(node_colors.max(initial=0))
+    return {'name': name, 'labels': list(legend_labels)[:max_color + 1], 'colors': list(colors),
+            'node_colors': node_colors.tolist()}
+
+
+def copy_viewer(folder):
+    shutil.copy(VIEWER_FILE, folder)
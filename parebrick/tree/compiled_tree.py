@@ -0,0 +1,191 @@
+import numpy as np
+
+# trees with fewer nodes keep dense node to node distance matrix
+DENSE_DISTANCE_MAX_NODES = 2048
+
+
+def group_by_value(values, selected):
+    # indexes of selected elements grouped by value in increasing order of value
+    inds = np.where(selected)[0]
+    inds = inds[np.argsort(values[inds], kind='stable')]
+    _, starts = np.unique(values[inds], return_index=True)
+    return np.split(inds, starts[1:])
+
+
+def encode_states(states):
+    # replaces states of every character with its rank among distinct states of this character,
+    # so colorsets of any character fit into a small bitmask
+    k = states.shape[0]
+    order = np.argsort(states, axis=1, kind='stable')
+    sorted_states = np.take_along_axis(states, order, axis=1)
+
+    is_new = np.ones(sorted_states.shape, dtype=bool)
+    is_new[:, 1:] = sorted_states[:, 1:] != sorted_states[:, :-1]
+    sorted_codes = np.cumsum(is_new, axis=1) - 1
+
+    codes = np.empty_like(sorted_codes)
+    np.put_along_axis(codes, order, sorted_codes, axis=1)
+
+    n_colors = int(sorted_codes[:, -1].max()) + 1
+    palette = np.zeros((k, n_colors), dtype=states.dtype)
+    rows, cols = np.nonzero(is_new)
+    palette[rows, sorted_codes[rows, cols]] = sorted_states[rows, cols]
+
+    counts = np.bincount((np.arange(k)[:, None] * n_colors + codes).ravel(), minlength=k * n_colors)
+    return codes, palette, counts.reshape(k, n_colors)
+
+
+class FitchResult:
+    def __init__(self, node_colors, innovations, parent):
+        self.node_colors = node_colors
+        self.innovations = innovations
+        self.parent = parent
+
+    def __len__(self):
+        return self.node_colors.shape[0]
+
+    def character_innovations(self, i):
+        colors, innovations = self.node_colors[i], self.innovations[i]
+        changes = np.zeros_like(colors)
+        changes[innovations] = colors[innovations] - colors[self.parent[innovations]]
+
+        by_color = {colors[nodes[0]]: nodes for nodes in group_by_value(colors, innovations) if len(nodes) > 0}
+        by_change = {changes[nodes[0]]: nodes for nodes in group_by_value(changes, innovations) if len(nodes) > 0}
+        return by_color, by_change
+
+
+class CompiledTree:
+    def __init__(self, tree):
+        nodes = list(tree.traverse('postorder'))
+        index = {node: i for i, node in enumerate(nodes)}
+
+        n = self.n = len(nodes)
+        self.root = n - 1
+        self.parent = np.full(n, -1, dtype=np.int64)
+        self.children = np.full((n, 2), -1, dtype=np.int64)
+        self.dist = np.array([node.dist for node in nodes], dtype=float)
+
+        for i, node in enumerate(nodes):
+            if node.is_leaf(): continue
+            if len(node.children) != 2:
+                print(node.children)
+                raise ValueError('Tree must me binary')
+            self.children[i] = [index[child] for child in node.children]
+            self.parent[self.children[i]] = i
+
+        self.is_leaf = self.children[:, 0] == -1
+        self.leaves = np.where(self.is_leaf)[0]
+        self.leaf_names = [nodes[i].name for i in self.leaves]
+
+        # height for bottom-up pass, level for top-down pass
+        height, level = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        for i in range(n):
+            if not self.is_leaf[i]: height[i] = height[self.children[i]].max() + 1
+        self.depth = np.zeros(n, dtype=float)
+        for i in reversed(range(n - 1)):
+            level[i] = level[self.parent[i]] + 1
+            self.depth[i] = self.depth[self.parent[i]] + self.dist[i]
+
+        self.up_levels = group_by_value(height, ~self.is_leaf)
+        self.down_levels = group_by_value(level, ~self.is_leaf & (level > 0))
+
+        self.build_lca(level)
+        self.distances = None
+        if n <= DENSE_DISTANCE_MAX_NODES: self.distances = self.distance(*np.indices((n, n)))
+
+    # euler tour with sparse table of minimal levels on its intervals gives lca of any two nodes in O(1)
+    def build_lca(self, level):
+        euler, self.first = [], np.zeros(self.n, dtype=np.int64)
+        stack = [(self.root, 0)]
+        while stack:
+            v, visited_children = stack.pop()
+            if visited_children == 0: self.first[v] = len(euler)
+            euler.append(v)
+            if not self.is_leaf[v] and visited_children < 2:
+                stack.append((v, visited_children + 1))
+                stack.append((self.children[v, visited_children], 0))
+
+        self.euler = np.array(euler, dtype=np.int64)
+        euler_level = level[self.euler]
+
+        sparse = [np.arange(len(euler))]
+        while 2 ** len(sparse) <= len(euler):
+            half, prev = 2 ** (len(sparse) - 1), sparse[-1]
+            left, right = prev[:-half], prev[half:]
+            sparse.append(np.where(euler_level[left] <= euler_level[right], left, right))
+
+        self.euler_level = euler_level
+        self.sparse = np.array([np.pad(row, (0, len(euler) - len(row))) for row in sparse])
+
+    def lca(self, a, b):
+        l, r = np.minimum(self.first[a], self.first[b]), np.maximum(self.first[a], self.first[b])
+        j = np.log2(r - l + 1).astype(np.int64)
+        i1, i2 = self.sparse[j, l], self.sparse[j, r - (1 << j) + 1]
+        return self.euler[np.where(self.euler_level[i1] <= self.euler_level[i2], i1, i2)]
+
+    def distance(self, a, b):
+        if self.distances is not None: return self.distances[a, b]
+        return self.depth[a] + self.depth[b] - 2 * self.depth[self.lca(a, b)]
+
+    def pairwise_distance_sum(self, nodes):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        m = len(nodes)
+        if m < 2: return 0
+
+        if m * (m - 1) // 2 <= self.n:
+            i1, i2 = np.triu_indices(m, 1)
+            return float(self.distance(nodes[i1], nodes[i2]).sum())
+
+        # for many nodes it is cheaper to count for every edge how many pairs are separated by it
+        below = np.bincount(nodes, minlength=self.n)
+        for level_nodes in self.up_levels:
+            below[level_nodes] += below[self.children[level_nodes]].sum(axis=1)
+        return float((self.dist * below * (m - below)).sum())
+
+    def leaf_states(self, leaf_colors_list):
+        return np.array([[leaf_colors[name] for name in self.leaf_names] for leaf_colors in leaf_colors_list],
+                        dtype=np.int64).reshape(len(leaf_colors_list), len(self.leaf_names))
+
+    # node colors of every character (row of leaf states)
+    def fitch(self, states):
+        def chose_color(masks):
+            in_colorset = (masks[:, :, None] >> shifts) & 1
+            return np.where(in_colorset != 0, counts[:, None, :], -1).argmax(axis=2)
+
+        codes, palette, counts = encode_states(states)
+        n_colors = palette.shape[1]
+
+        # python integers are used as bitmasks only if there are too many states for one machine word
+        dtype = np.uint64 if n_colors <= 64 else object
+        shifts = np.arange(n_colors).astype(dtype)
+        bits = np.array([1 << c for c in range(n_colors)], dtype=dtype)
+
+        # get colorsets for internal nodes
+        masks = np.zeros((len(states), self.n), dtype=dtype)
+        masks[:, self.leaves] = bits[codes]
+        for nodes in self.up_levels:
+            cs1, cs2 = masks[:, self.children[nodes, 0]], masks[:, self.children[nodes, 1]]
+            both = cs1 & cs2
+            masks[:, nodes] = np.where(both != 0, both, cs1 | cs2)
+
+        # get color for internal nodes
+        colors = np.zeros((len(states), self.n), dtype=np.int64)
+        colors[:, self.leaves] = codes
+        colors[:, [self.root]] = chose_color(masks[:, [self.root]])
+        for nodes in self.down_levels:
+            parent_colors = colors[:, self.parent[nodes]]
+            keep = (masks[:, nodes] >> parent_colors.astype(dtype)) & 1
+            colors[:, nodes] = np.where(keep != 0, parent_colors, chose_color(masks[:, nodes]))
+
+        return np.take_along_axis(palette, colors, axis=1)
+
+    # inconsistent colors of nodes, they don't depend on fitch results of other characters,
+    # so innovations of cached node colors are counted for any count_second_color
+    def fitch_result(self, node_colors, count_second_color=True):
+        parent_colors = node_colors[:, self.parent]
+        innovations = (parent_colors != node_colors) & (node_colors != 2)
+        if not count_second_color:
+            innovations &= parent_colors != 2
+        innovations[:, self.root] = False
+
+        return FitchResult(node_colors, innovations, self.parent)
@@ -4,6 +4,10 @@ from itertools import chain
 
 import numpy as np
 
+NEIGHBOURS_COLORS = ('Crimson', 'Teal', 'DarkGreen', 'Purple', 'DarkKhaki', 'MediumVioletRed', 'DarkOrange', 'Navy',
+                     'RosyBrown', 'DarkGoldenrod', 'Sienna', 'Indigo', 'DarkRed', 'Olive', 'SlateGray', 'SeaGreen',
+                     'IndianRed', 'BurlyWood')
+
 
 def get_neighbour_motifs(n, ns_colors, offset, inverse=False):
     block, orient = n[:-1], n[-1]
@@ -17,7 +21,17 @@ def get_neighbour_motifs(n, ns_colors, offset, inverse=False):
                 [offset + 10, offset + 40, "[]", None, 10, clr, clr, f"arial|2|white|-{block}"]]
 
 
-def generate_neighbour_face(node_ns, ns_colors, block, offsets):
+# colors of neighbours of block in all genomes, block itself is grey
+def get_neighbours_colors(neighbours, block, colors=NEIGHBOURS_COLORS):
+    posible_ns = sorted(list(set(n[:-1] for nss in neighbours.values() for ns in nss for n in ns[:2])))
+
+    ns_colors = {posible_ns[i]: colors[i % len(colors)] for i in range(len(posible_ns))}
+    ns_colors[str(block)] = 'grey'
+    return ns_colors
+
+
+# motifs of neighbours of block in one genome: [start, end, shape, _, height, fgcolor, bgcolor, text]
+def get_neighbour_face_motifs(node_ns, ns_colors, block, offsets):
     motifs = [[0, 0, "blank", None, 10, None, None, None]]
 
     for cur_offset, next_offset, node_n in zip(offsets, offsets.tolist()[1:], node_ns):
@@ -40,7 +54,11 @@ def generate_neighbour_face(node_ns, ns_colors, block, offsets):
         motifs.append([offset - 10, offset - 10, "[]", None, 10, 'grey', 'grey', None])
         motifs.append([offset - 10, offset, "blank", None, 10, None, None, None])
 
-    return SeqMotifFace('', motifs=motifs)
+    return motifs
+
+
+def generate_neighbour_face(node_ns, ns_colors, block, offsets):
+    return SeqMotifFace('', motifs=get_neighbour_face_motifs(node_ns, ns_colors, block, offsets))
 
 
 def align_neighbours(neighbours, all_genomes):
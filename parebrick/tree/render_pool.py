@@ -0,0 +1,76 @@
+import logging
+import os
+
+from multiprocessing import Pool
+
+from parebrick.tree.tree_holder import TreeHolder
+from parebrick.tree.bundle import write_bundle, bundle_character
+
+
+def init_worker(newick, tree_holder_params, renderer):
+    global worker_tree_holder, worker_renderer
+    worker_renderer = renderer
+    if renderer is None:
+        worker_tree_holder = TreeHolder(newick, logging.getLogger(), reroot=False, **tree_holder_params)
+
+
+def draw_in_worker(file, node_colors, draw_params):
+    if worker_renderer is not None:
+        worker_renderer.draw(file, node_colors, **draw_params)
+        return
+    worker_tree_holder.node_colors = node_colors
+    worker_tree_holder.draw(file, **draw_params)
+
+
+# Renders trees in a pool of processes, each of them holds its own copy of tree built once from newick,
+# only node colors of characters are sent to them. With one thread tree holder draws trees by itself.
+# With bundle file nothing is rendered, node colors of all characters are written to bundle instead.
+# Trees are drawn by renderer if it's given (e.g. SvgRenderer) and written with given extension instead of .pdf.
+class RenderPool:
+    def __init__(self, tree_holder, threads=1, bundle_file=None, renderer=None, extension='.pdf'):
+        self.tree_holder = tree_holder
+        self.pool = None
+        self.tasks = []
+        self.bundle_file = bundle_file
+        self.bundle_characters = []
+        self.renderer = renderer
+        self.extension = extension
+
+        if threads > 1 and bundle_file is None:
+            self.pool = Pool(threads, init_worker, (tree_holder.newick(), tree_holder.params, renderer))
+
+    # draws current node colors of tree holder
+    def draw(self, file, **draw_params):
+        file = os.path.splitext(file)[0] + self.extension
+        if self.bundle_file is not None:
+            name = os.path.relpath(os.path.splitext(file)[0], os.path.dirname(self.bundle_file))
+            self.bundle_characters.append(bundle_character(name, self.tree_holder.node_colors, **draw_params))
+        elif self.pool is None and self.renderer is not None:
+            self.renderer.draw(file, self.tree_holder.node_colors, **draw_params)
+        elif self.pool is None:
+            self.tree_holder.draw(file, **draw_params)
+        else:
+            self.tasks.append(self.pool.apply_async(draw_in_worker, (file, self.tree_holder.node_colors, draw_params)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.bundle_file is not None and exc_type is None:
+            write_bundle(self.bundle_file, self.tree_holder, self.bundle_characters)
+        if self.pool is None: return
+
+        if exc_type is not None:
+            self.pool.terminate()
+            self.pool.join()
+            return
+
+        self.pool.close()
+        try:
+            for task in self.tasks:
+                task.get()
+        except BaseException:
+            self.pool.terminate()
+            raise
+        finally:
+            self.pool.join()
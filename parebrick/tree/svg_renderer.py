@@ -0,0 +1,237 @@
+import math
+
+from xml.sax.saxutils import escape
+
+from parebrick.tree.neighbours_utils import align_neighbours, get_offsets, get_neighbours_colors, \
+    get_neighbour_face_motifs
+
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+WIDTH = 1000
+MARGIN = 10
+ROW_HEIGHT = 20
+# approximate width of one character of leaf label in pixels
+CHAR_WIDTH = 7
+FONT_SIZE = 12
+
+
+def svg_to_pdf_available():
+    return cairosvg is not None
+
+
+# Draws tree colorings to svg (or pdf via cairosvg) without ete3 and Qt. Layout of tree is computed once for every
+# mode ('r' rectangular or 'c' circular) and cached as svg of branches and labels and shapes of nodes backgrounds,
+# so drawing of character only writes fill colors of nodes and legend.
+class SvgRenderer:
+    def __init__(self, tree_holder):
+        nodes = list(tree_holder.tree.traverse('postorder'))
+        index = {id(node): i for i, node in enumerate(nodes)}
+        labels_dict = tree_holder.params['labels_dict']
+
+        self.n = len(nodes)
+        self.parents = [index[id(node.up)] if node.up else -1 for node in nodes]
+        self.children = [[index[id(child)] for child in node.children] for node in nodes]
+        self.genomes = [node.name for node in nodes]
+        self.labels = [(labels_dict[node.name] if labels_dict else node.name) if node.is_leaf() else ''
+                       for node in nodes]
+        self.supports = [node.support for node in nodes]
+        self.all_genomes = [node.name for node in tree_holder.tree.traverse()]
+
+        # depths from root and ranges of leaves in subtrees in order of leaves in postorder
+        self.depths = [0.0] * self.n
+        for i in reversed(range(self.n)):
+            if self.parents[i] != -1: self.depths[i] = self.depths[self.parents[i]] + nodes[i].dist
+
+        self.first, self.last, self.leaves = [0] * self.n, [0] * self.n, 0
+        for i in range(self.n):
+            if self.children[i]:
+                self.first[i], self.last[i] = self.first[self.children[i][0]], self.last[self.children[i][-1]]
+            else:
+                self.first[i] = self.last[i] = self.leaves
+                self.leaves += 1
+
+        self.max_depth = max(self.depths) or 1
+        self.labels_width = CHAR_WIDTH * max(map(len, self.labels)) + 2 * MARGIN
+        self.layouts = {}
+
+    # positions of leaves are in [0, leaves), internal nodes are in the middle of their first and last children
+    def positions(self):
+        positions = [0.0] * self.n
+        for i in range(self.n):
+            children = self.children[i]
+            positions[i] = (positions[children[0]] + positions[children[-1]]) / 2 if children else self.first[i]
+        return positions
+
+    def layout(self, mode):
+        if mode not in self.layouts:
+            self.layouts[mode] = self.circular_layout() if mode == 'c' else self.rectangular_layout()
+        return self.layouts[mode]
+
+    def rectangular_layout(self):
+        tree_width = WIDTH - self.labels_width - 2 * MARGIN
+        x = [MARGIN + depth / self.max_depth * tree_width for depth in self.depths]
+        y = [MARGIN + (position + 0.5) * ROW_HEIGHT for position in self.positions()]
+        right, height = WIDTH - MARGIN, self.leaves * ROW_HEIGHT + 2 * MARGIN
+
+        backgrounds, paths, labels, supports = [], [], [], []
+        for i in range(self.n):
+            parent_x = x[self.parents[i]] if self.parents[i] != -1 else MARGIN
+            top, bottom = MARGIN + self.first[i] * ROW_HEIGHT, MARGIN + (self.last[i] + 1) * ROW_HEIGHT
+            backgrounds.append(f'<rect x="{parent_x:.1f}" y="{top:.1f}" width="{right - parent_x:.1f}" '
+                               f'height="{bottom - top:.1f}"')
+
+            paths.append(f'M{parent_x:.1f},{y[i]:.1f}H{x[i]:.1f}')
+            if self.children[i]:
+                first, last = y[self.children[i][0]], y[self.children[i][-1]]
+                paths.append(f'M{x[i]:.1f},{first:.1f}V{last:.1f}')
+                supports.append(self.text(x[i] - 2, y[i] - 3, f'{self.supports[i]:g}', anchor='end', size=9))
+            else:
+                labels.append(self.text(x[i] + 4, y[i] + 4, self.labels[i]))
+
+        # neighbours are aligned after the longest label
+        aligned_x = max(x[i] + CHAR_WIDTH * len(self.labels[i]) for i in range(self.n)) + 2 * MARGIN
+        return {'backgrounds': backgrounds, 'branches': self.branches(paths) + ''.join(labels),
+                'supports': ''.join(supports), 'scale': self.scale_bar(MARGIN, height + ROW_HEIGHT, tree_width),
+                'width': WIDTH, 'height': height + 2 * ROW_HEIGHT, 'y': y, 'aligned_x': aligned_x}
+
+    def circular_layout(self):
+        radius = WIDTH / 2 - self.labels_width - MARGIN
+        outer, center = WIDTH / 2 - MARGIN, WIDTH / 2
+        r = [depth / self.max_depth * radius for depth in self.depths]
+        step = 2 * math.pi / self.leaves
+        angles = [(position + 0.5) * step for position in self.positions()]
+
+        def xy(radius, angle):
+            return center + radius * math.cos(angle), center + radius * math.sin(angle)
+
+        def point(radius, angle):
+            return '{:.1f},{:.1f}'.format(*xy(radius, angle))
+
+        def arc(radius, start, end, sweep=1):
+            large = int(end - start > math.pi)
+            return f'A{radius:.1f},{radius:.1f} 0 {large} {sweep} {point(radius, end if sweep else start)}'
+
+        backgrounds, paths, labels, supports = [], [], [], []
+        for i in range(self.n):
+            parent_r = r[self.parents[i]] if self.parents[i] != -1 else 0
+            start, end = self.first[i] * step, (self.last[i] + 1) * step
+            if end - start >= 2 * math.pi - 1e-9:
+                backgrounds.append(f'<circle cx="{center}" cy="{center}" r="{outer:.1f}"')
+            else:
+                backgrounds.append(f'<path d="M{point(outer, start)}{arc(outer, start, end)}L{point(parent_r, end)}'
+                                   f'{arc(parent_r, start, end, 0)}Z"')
+
+            paths.append(f'M{point(parent_r, angles[i])}L{point(r[i], angles[i])}')
+            if self.children[i]:
+                first, last = angles[self.children[i][0]], angles[self.children[i][-1]]
+                paths.append(f'M{point(r[i], first)}{arc(r[i], first, last)}')
+                supports.append(self.text(*xy(r[i] + 3, angles[i]), f'{self.supports[i]:g}', size=9))
+            else:
+                degrees = math.degrees(angles[i])
+                # labels on the left side are turned over to be read from left to right
+                flip = 90 < degrees < 270
+                labels.append(self.text(*xy(r[i] + 4, angles[i]), self.labels[i], anchor='end' if flip else 'start',
+                                        rotate=degrees - 180 if flip else degrees))
+
+        return {'backgrounds': backgrounds, 'branches': self.branches(paths) + ''.join(labels),
+                'supports': ''.join(supports), 'scale': self.scale_bar(MARGIN, WIDTH + ROW_HEIGHT, radius),
+                'width': WIDTH, 'height': WIDTH + 2 * ROW_HEIGHT}
+
+    @staticmethod
+    def branches(paths):
+        return f'<path d="{"".join(paths)}" stroke="black" fill="none"/>'
+
+    # bar of round length in units of branch lengths
+    def scale_bar(self, x, y, tree_width):
+        length = 10 ** math.floor(math.log10(self.max_depth / 5)) if self.max_depth > 0 else 1
+        bar = length / self.max_depth * tree_width
+        return f'<path d="M{x},{y - 4}V{y}H{x + bar:.1f}V{y - 4}" stroke="black" fill="none"/>' + \
+            self.text(x + bar + 4, y + 4, f'{length:g}')
+
+    @staticmethod
+    def text(x, y, text, anchor='start', size=FONT_SIZE, color='black', rotate=None):
+        transform = f' transform="rotate({rotate:.1f} {x:.1f} {y:.1f})"' if rotate else ''
+        return f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" text-anchor="{anchor}" fill="{color}"' \
+               f'{transform}>{escape(text)}</text>'
+
+    def legend(self, colors, node_colors, used_colors, legend_labels, legend_scale):
+        rows = []
+        for label, color in zip(legend_labels, colors[0:max(node_colors, default=0) + 1]):
+            if color not in used_colors: continue
+            y = MARGIN + len(rows) * 22 * legend_scale
+            rows.append(f'<rect x="{MARGIN}" y="{y:.1f}" width="{20 * legend_scale}" height="{16 * legend_scale}" '
+                        f'fill="{color}" stroke="black"/>' +
+                        self.text(MARGIN + 34 * legend_scale, y + 13 * legend_scale, label, size=14 * legend_scale))
+        return ''.join(rows), len(rows) * 22 * legend_scale + MARGIN
+
+    def neighbours(self, layout, neighbours, block):
+        ns_colors = get_neighbours_colors(neighbours, block)
+        aligned_neighbours = align_neighbours(neighbours, self.all_genomes)
+        offsets = get_offsets(aligned_neighbours)
+
+        shapes = []
+        for i in range(self.n):
+            if self.children[i]: continue
+            x, y = layout['aligned_x'], layout['y'][i]
+            for start, end, shape, _, height, fgcolor, bgcolor, text in \
+                    get_neighbour_face_motifs(aligned_neighbours[self.genomes[i]], ns_colors, block, offsets):
+                top, bottom = y - height / 2, y + height / 2
+                if shape == '[]':
+                    shapes.append(f'<rect x="{x + start}" y="{top}" width="{end - start}" height="{height}" '
+                                  f'fill="{bgcolor}" stroke="{fgcolor}"/>')
+                elif shape in ('>', '<'):
+                    tip, base = (x + end, x + start) if shape == '>' else (x + start, x + end)
+                    shapes.append(f'<path d="M{base},{top}L{tip},{y}L{base},{bottom}Z" fill="{bgcolor}"/>')
+                if text:
+                    _, size, color, label = text.split('|')
+                    shapes.append(self.text(x + (start + end) / 2, y + 3, label, anchor='middle',
+                                            size=max(int(size), 8), color=color))
+
+        width = layout['aligned_x'] + int(offsets[-1]) + MARGIN
+        return ''.join(shapes), width
+
+    # the same parameters as TreeHolder.draw has
+    def draw(self, file, node_colors, colors, color_internal_nodes=True, legend_labels=(), show_branch_support=True,
+             show_scale=True, legend_scale=1, mode="c", neighbours=None, neighbours_block=None):
+        layout = self.layout(mode)
+        max_color = len(colors)
+        node_colors = node_colors.tolist()
+
+        # nodes are drawn from root, so backgrounds of children cover backgrounds of parents and
+        # nodes of the same color as their parents are not drawn at all
+        used_colors, shapes, drawn_colors = set(), [], [None] * self.n
+        for i in reversed(range(self.n)):
+            parent = self.parents[i]
+            drawn_colors[i] = drawn_colors[parent] if parent != -1 else None
+            if not (color_internal_nodes or not self.children[i]): continue
+
+            color = colors[min(node_colors[i], max_color - 1)]
+            used_colors.add(color)
+            if color == drawn_colors[i]: continue
+            drawn_colors[i] = color
+            shapes.append(f'{layout["backgrounds"][i]} fill="{color}"/>')
+
+        legend, legend_height = self.legend(colors, node_colors, used_colors, legend_labels, legend_scale)
+        width = layout['width']
+        tree = ''.join(shapes) + layout['branches']
+        if show_branch_support: tree += layout['supports']
+        if show_scale: tree += layout['scale']
+        if neighbours and mode == 'r':
+            neighbour_shapes, width = self.neighbours(layout, neighbours, neighbours_block)
+            tree += neighbour_shapes
+
+        height = layout['height'] + legend_height
+        svg = f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" ' \
+              f'font-family="Arial, sans-serif">{legend}<g transform="translate(0,{legend_height:.1f})">{tree}</g>' \
+              f'</svg>'
+
+        if file.endswith('.pdf'):
+            if cairosvg is None:
+                raise ImportError('cairosvg is required for converting svg trees to pdf')
+            cairosvg.svg2pdf(bytestring=svg.encode(), write_to=file)
+        else:
+            with open(file, 'w') as f:
+                f.write(svg)
@@ -1,9 +1,19 @@
+import logging
+
+import numpy as np
+
 from ete3 import Tree, TreeStyle, TextFace, RectFace
 
-from collections import defaultdict, Counter
-from itertools import combinations
+from collections import defaultdict, OrderedDict
+
+from parebrick.tree.neighbours_utils import generate_neighbour_face, align_neighbours, get_offsets, \
+    get_neighbours_colors, NEIGHBOURS_COLORS
+from parebrick.tree.compiled_tree import CompiledTree
 
-from parebrick.tree.neighbours_utils import generate_neighbour_face, align_neighbours, get_offsets
+# limit for characters x nodes cells processed by one batch of fitch algorithm
+FITCH_BATCH_CELLS = 2 ** 22
+# limit for characters x nodes cells of node colors kept in cache of fitch results
+FITCH_CACHE_CELLS = 2 ** 24
 
 
 class TreeHolder:
@@ -11,6 +21,9 @@ class TreeHolder:
                  reroot=True, hz_line_width=1, vt_line_width=1):
         self.tree = Tree(tree)
         self.scale = scale
+        # parameters for building the same tree holder in other processes
+        self.params = dict(scale=scale, labels_dict=labels_dict, hz_line_width=hz_line_width,
+                           vt_line_width=vt_line_width)
 
         if reroot:
             r = self.tree.get_midpoint_outgroup()
@@ -39,14 +52,21 @@ class TreeHolder:
                     raise KeyError(msg)
                 node.add_face(name_face, column=0)
 
-    def draw_neighbours(self, neighbours, block, colors=('Crimson', 'Teal', 'DarkGreen', 'Purple', 'DarkKhaki',
-                                                         'MediumVioletRed', 'DarkOrange', 'Navy', 'RosyBrown',
-                                                         'DarkGoldenrod', 'Sienna', 'Indigo', 'DarkRed', 'Olive',
-                                                         'SlateGray', 'SeaGreen', 'IndianRed', 'BurlyWood')):
-        posible_ns = sorted(list(set(n[:-1] for nss in neighbours.values() for ns in nss for n in ns[:2])))
+        self.compiled = CompiledTree(self.tree)
+        self.fitch_cache = OrderedDict()
+
+    def newick(self):
+        return self.tree.write(format=0, dist_formatter='%0.17g', support_formatter='%0.17g')
+
+    # tree holder is pickled as newick of its already rooted and pruned tree
+    def __getstate__(self):
+        return {'newick': self.newick(), 'params': self.params}
 
-        ns_colors = {posible_ns[i]: colors[i % len(colors)] for i in range(len(posible_ns))}
-        ns_colors[str(block)] = 'grey'
+    def __setstate__(self, state):
+        self.__init__(state['newick'], logging.getLogger(), reroot=False, **state['params'])
+
+    def draw_neighbours(self, neighbours, block, colors=NEIGHBOURS_COLORS):
+        ns_colors = get_neighbours_colors(neighbours, block, colors)
 
         # if block != 2: return
         all_genomes = [node.name for node in self.tree.traverse()]
@@ -63,9 +83,9 @@ class TreeHolder:
         max_color = len(colors)
 
         used_colors = set()
-        for node in self.tree.traverse():
+        for node, node_color in zip(self.tree.traverse('postorder'), self.node_colors):
             if not (color_internal_nodes or node.is_leaf()): continue
-            color = colors[min(node.color, max_color - 1)]
+            color = colors[min(node_color, max_color - 1)]
             node.img_style['bgcolor'] = color
             used_colors.add(color)
 
@@ -78,7 +98,7 @@ class TreeHolder:
 
         # ts.branch_vertical_margin = 20
         ts.show_scale = show_scale
-        cur_max_color = max(v.color for v in self.tree.traverse())
+        cur_max_color = self.node_colors.max()
         current_colors = colors[0:cur_max_color + 1]
 
         for i, (label, color_) in enumerate(zip(legend_labels, current_colors)):
@@ -95,64 +115,67 @@ class TreeHolder:
             ts.legend.add_face(tf, column=1)
 
         if neighbours:
-            old_tree = self.tree.copy()
             self.draw_neighbours(neighbours, neighbours_block)
 
         self.tree.render(file, w=1000, tree_style=ts)
 
+        # faces of neighbours are removed instead of drawing on copy of tree
         if neighbours:
-            self.tree = old_tree
+            for node in self.tree.iter_leaves():
+                node.faces.aligned.clear()
+
+    # tree as arrays of nodes in postorder, the same order as node colors have
+    def tree_arrays(self):
+        nodes = list(self.tree.traverse('postorder'))
+        index = {id(node): i for i, node in enumerate(nodes)}
+        labels_dict = self.params['labels_dict'] or {}
+        return {'names': [labels_dict.get(node.name, node.name) if node.is_leaf() else '' for node in nodes],
+                'parents': [index[id(node.up)] if node.up else -1 for node in nodes],
+                'lengths': [node.dist for node in nodes],
+                'support': [node.support for node in nodes]}
 
     def get_all_leafs(self):
         return {node.name for node in self.tree.get_leaves()}
 
     def count_innovations_fitch(self, leaf_colors, count_second_color=True):
-        def assign_colorset_feature(v):
-            if v.is_leaf():
-                v.add_features(colorset={leaf_colors[v.name]}, color=leaf_colors[v.name])
-            else:
-                try:
-                    child1, child2 = v.children
-                except ValueError:
-                    print(v.children)
-                    raise ValueError('Tree must me binary')
-                cs1 = assign_colorset_feature(child1)
-                cs2 = assign_colorset_feature(child2)
-                v.add_features(colorset=(cs1 & cs2) if len(cs1 & cs2) > 0 else cs1 | cs2)
-
-            return v.colorset
-
-        def chose_color(colorset):
-            return sorted(colorset, key=lambda c: color_counter[c], reverse=True)[0]
-
-        def down_to_leaves(v, color):
-            if v.is_leaf(): return
-            v.add_features(color=color if color in v.colorset else chose_color(v.colorset))
-            for child in v.children:
-                down_to_leaves(child, v.color)
-
-        def count_innovations(v, innovations, insertions_deltitions):
-            for child in v.children:
-                if v.color != child.color and not (not count_second_color and (v.color == 2) or (child.color == 2)):
-                    innovations[child.color].append(child)
-                    insertions_deltitions[child.color - v.color].append(child)
-                count_innovations(child, innovations, self.insertions_deltitions)
-
-        color_counter = Counter(leaf_colors.values())
-        # print(color_counter)
-
-        # get colorsets for internal nodes
-        root = self.tree.get_tree_root()
-        assign_colorset_feature(root)
-
-        # get color for internal nodes
-        root_color = chose_color(root.colorset)
-        down_to_leaves(root, root_color)
-
-        # get inconsistent colors
-        self.innovations = defaultdict(list)
-        self.insertions_deltitions = defaultdict(list)
-        count_innovations(root, self.innovations, self.insertions_deltitions)
+        for _ in self.count_innovations_fitch_batch([leaf_colors], count_second_color): pass
+
+    # runs fitch algorithm for many characters at once, after each yield innovations of the next character are set;
+    # node colors are kept in LRU cache by leaf states, so the same coloring is not counted again in next stages,
+    # innovations are counted from them for given count_second_color
+    def count_innovations_fitch_batch(self, leaf_colors_list, count_second_color=True):
+        batch_size = max(1, FITCH_BATCH_CELLS // self.compiled.n)
+        for batch_start in range(0, len(leaf_colors_list), batch_size):
+            states = self.compiled.leaf_states(leaf_colors_list[batch_start:batch_start + batch_size])
+            keys = [row.tobytes() for row in states]
+
+            node_colors = {}
+            for key in keys:
+                if key in self.fitch_cache:
+                    self.fitch_cache.move_to_end(key)
+                    node_colors[key] = self.fitch_cache[key]
+
+            missing = {}
+            for i, key in enumerate(keys):
+                if key not in node_colors: missing.setdefault(key, i)
+
+            if missing:
+                colors = self.compiled.fitch(states[list(missing.values())])
+                for j, key in enumerate(missing):
+                    # row is copied, so cache doesn't keep the whole batch
+                    node_colors[key] = colors[j].copy()
+                    self.cache_fitch_result(key, node_colors[key])
+
+            result = self.compiled.fitch_result(np.stack([node_colors[key] for key in keys]), count_second_color)
+            for i in range(len(keys)):
+                self.node_colors = result.node_colors[i]
+                self.innovations, self.insertions_deltitions = result.character_innovations(i)
+                yield self.node_colors
+
+    def cache_fitch_result(self, key, value):
+        self.fitch_cache[key] = value
+        while len(self.fitch_cache) > max(1, FITCH_CACHE_CELLS // self.compiled.n):
+            self.fitch_cache.popitem(last=False)
 
     def count_parallel_rearrangements(self, skip_grey):
         score, count, count_all = 0, 0, 0
@@ -160,22 +183,22 @@ class TreeHolder:
             if len(nodes) <= 1 or (skip_grey and color == 1): continue
             count += 1
             count_all += len(nodes)
-            for n1, n2 in combinations(nodes, 2):
-                score += n1.get_distance(n2)
+            score += self.compiled.pairwise_distance_sum(nodes)
         return score, count, count_all
 
     def count_parallel_breakpoints(self):
         count = sum(map(len, self.innovations.values()))
-        score = sum(
-            n1.get_distance(n2) for n1, n2 in combinations((n for ns in self.innovations.values() for n in ns), 2))
+        score = self.compiled.pairwise_distance_sum([n for ns in self.innovations.values() for n in ns])
         return score, count
 
     def draw_coloring(self, file):
-        for node in self.tree.traverse():
-            node.img_style['bgcolor'] = self.colors[node.color]
+        for node, node_color in zip(self.tree.traverse('postorder'), self.node_colors):
+            node.img_style['bgcolor'] = self.colors[node_color]
         ts = TreeStyle()
         ts.show_leaf_name = False
         self.tree.render(file, w=1000, tree_style=ts)
 
     def prune(self, ls):
         self.tree.prune(list(ls))
+        self.compiled = CompiledTree(self.tree)
+        self.fitch_cache.clear()
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import pickle
+
+# must be increased when format of cached values changes
+CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+def file_hash(file):
+    if not file or not os.path.isfile(file): return ''
+
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dump_pickle(value, path):
+    # written to temporary file first, so interrupted run never leaves broken file
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Results of expensive stages pickled to files named by stage and hash of their inputs and parameters,
+# so runs with the same input data reuse them and runs with other data or parameters recompute them.
+class StageCache:
+    def __init__(self, folder, logger, enabled=True):
+        self.folder = folder
+        self.logger = logger
+        self.enabled = enabled
+        self.file_hashes = {}
+
+        if enabled: os.makedirs(folder, exist_ok=True)
+
+    def hash_of(self, file):
+        if file not in self.file_hashes: self.file_hashes[file] = file_hash(file)
+        return self.file_hashes[file]
+
+    # files are not hashed when cache is disabled, key is None then
+    def key(self, stage, files=(), **params):
+        if not self.enabled: return None
+
+        h = hashlib.sha256(f'{CACHE_VERSION} {stage}'.encode())
+        for file in files:
+            h.update(self.hash_of(file).encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()[:32]
+
+    def path(self, stage, key):
+        return os.path.join(self.folder, f'{stage.lower().replace(" ", "_")}_{key}.pkl')
+
+    def load(self, stage, key):
+        if not self.enabled or not os.path.isfile(self.path(stage, key)): return None
+
+        try:
+            value = load_pickle(self.path(stage, key))
+        except Exception as e:
+            self.logger.warning(f'Cache of {stage} can not be read and will be recomputed: {e}')
+            return None
+
+        self.logger.info(f'{stage} loaded from cache')
+        return value
+
+    def save(self, stage, key, value):
+        if not self.enabled: return
+        dump_pickle(value, self.path(stage, key))
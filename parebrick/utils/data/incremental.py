@@ -0,0 +1,32 @@
+import csv
+
+import numpy as np
+
+CHANGES_HEADER = ['module', 'character', 'change', 'previous_score', 'score', 'changed_strains']
+
+
+# characters of module are dicts: character -> (states of strains, score), states are compared by annotations,
+# so renumbering of states doesn't make character changed; character is changed if its score or state
+# of any strain of previous run is changed, states of new strains are not compared
+def characters_changes(module, previous, current):
+    rows = []
+    for character in sorted(set(previous) | set(current), key=str):
+        if character not in previous:
+            rows.append([module, character, 'new', '', current[character][1], ''])
+        elif character not in current:
+            rows.append([module, character, 'removed', previous[character][1], '', ''])
+        else:
+            (previous_states, previous_score), (states, score) = previous[character], current[character]
+            changed_strains = sum(previous_states[strain] != state for strain, state in states.items()
+                                  if strain in previous_states)
+            if changed_strains == 0 and np.isclose(previous_score, score): continue
+            rows.append([module, character, 'changed', previous_score, score, changed_strains])
+
+    return rows
+
+
+def write_changes_csv(rows, file):
+    with open(file, 'w') as f:
+        wtr = csv.writer(f)
+        wtr.writerow(CHANGES_HEADER)
+        wtr.writerows(rows)
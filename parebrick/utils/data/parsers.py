@@ -12,6 +12,9 @@ from collections import defaultdict, Counter
 PATTERN = re.compile("([A-Za-z0-9_\(\)\/\s\.-]+)\.([A-Za-z0-9_]+):(\d+)-(\d+) ([+|-]).*")
 COLUMNS = ["block", "species", "chr", "chr_beg", "chr_end", "orientation"]
 BLOCKS_SEPARATOR = '-' * 80
+BLOCKS_COORDS_COLUMNS = ['seq_id', 'strand', 'start', 'end', 'length']
+BLOCKS_COORDS_CHUNK_ROWS = 2 ** 20
+GRIMM_TERMINATOR = re.compile('[$@]')
 
 
 def parse_infercars_to_df(file_name):
@@ -41,22 +44,73 @@ def parse_infercars_to_df(file_name):
     return pd.DataFrame(temp, columns=COLUMNS)
 
 
-def export_df_to_infercars(df, file_name):
+def export_df_to_infercars(df, file_name, sort_blocks=True):
+    if sort_blocks: df = df.sort_values('block', kind='stable')
+
+    occurrences = (df['species'] + '.' + df['chr'] + ':' + df['chr_beg'].astype(str) + '-' +
+                   df['chr_end'].astype(str) + ' ' + df['orientation']).to_numpy()
+    blocks = df['block'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]]) if len(blocks) else np.zeros(0, dtype=int)
+
     with open(file_name, 'w') as f:
-        for block, block_df in df.groupby('block'):
-            print(f'>{block}', file=f)
-            for i, row in block_df.iterrows():
-                print(f'{row["species"]}.{row["chr"]}:{row["chr_beg"]}-{row["chr_end"]} {row["orientation"]}', file=f)
-            print(file=f)
+        for start, end in zip(starts, np.append(starts[1:], len(blocks))):
+            f.write(f'>{blocks[start]}\n' + '\n'.join(occurrences[start:end]) + '\n\n')
 
 
-def genome_lengths_from_block_coords(in_file):
+def read_block_coords_head(in_file):
     with open(in_file) as f:
         head_lines = list(takewhile(lambda line: (line != BLOCKS_SEPARATOR + os.linesep) and
                                                  (line != BLOCKS_SEPARATOR + '\n'), f))
 
+    return pd.read_csv(StringIO(''.join(head_lines)), sep='\t'), len(head_lines)
+
+
+# Reads blocks coords straight into columns of the same data frame as parse_infercars_to_df gives,
+# lines are read by chunks and block of every occurrence is taken from the last `Block #` line above it
+def parse_block_coords_to_df(in_file):
+    df_head, head_length = read_block_coords_head(in_file)
+    seq_ids = pd.Index(df_head['Seq_id'].astype(str))
+    descriptions = df_head['Description'].astype(str).to_numpy(dtype=object)
+
+    chunks = pd.read_csv(in_file, sep='\t', header=None, names=BLOCKS_COORDS_COLUMNS, usecols=range(4), dtype=str,
+                         skiprows=head_length, chunksize=BLOCKS_COORDS_CHUNK_ROWS)
+
+    columns, last_block = defaultdict(list), None
+    for chunk in chunks:
+        first_column = chunk['seq_id']
+        is_block_line = first_column.str.startswith('Block #')
+        block = first_column.str[len('Block #'):].where(is_block_line).ffill()
+        if last_block is not None: block = block.fillna(last_block)
+        if is_block_line.any(): last_block = block[is_block_line].iloc[-1]
+
+        is_occurrence = chunk['strand'].isin(['+', '-']).to_numpy()
+        seq_codes = seq_ids.get_indexer(first_column[is_occurrence])
+        if np.any(seq_codes == -1):
+            raise ValueError(f'Unknown sequence ids in {in_file}: {set(first_column[is_occurrence][seq_codes == -1])}')
+
+        forward = (chunk['strand'][is_occurrence] == '+').to_numpy()
+        start, end = (chunk[column][is_occurrence].to_numpy(dtype=np.int64) for column in ['start', 'end'])
+
+        columns['block'].append(block[is_occurrence].to_numpy(dtype=np.int32))
+        columns['seq'].append(seq_codes)
+        columns['forward'].append(forward)
+        columns['chr_beg'].append(np.where(forward, start, end))
+        columns['chr_end'].append(np.where(forward, end, start))
+
+    if not columns: return pd.DataFrame(columns=COLUMNS)
+    columns = {name: np.concatenate(arrays) for name, arrays in columns.items()}
+
+    return pd.DataFrame({'block': columns['block'],
+                         'species': descriptions[columns['seq']],
+                         'chr': '1',
+                         'chr_beg': columns['chr_beg'],
+                         'chr_end': columns['chr_end'],
+                         'orientation': np.where(columns['forward'], '+', '-').astype(object)}, columns=COLUMNS)
+
+
+def genome_lengths_from_block_coords(in_file):
     # names of chromosomes
-    df_head = pd.read_csv(StringIO(''.join(head_lines)), sep='\t')
+    df_head, _ = read_block_coords_head(in_file)
     return {row['Description'] + '.1': row['Size'] for index, row in df_head.iterrows()}
 
 def genome_genome_lengths_from_chromosomes_lengths(chr_lengths):
@@ -69,70 +123,165 @@ def genome_genome_lengths_from_chromosomes_lengths(chr_lengths):
     return lengths
 
 
-def get_genomes_contain_blocks_grimm(grimm_file):
-    genomes, blocks = set(), set()
+# Occurrences of blocks as columns sorted by species, chromosome and begin, with species and locations (chromosomes
+# of species) coded by ints: occurrences of i-th location are in loc_offsets[i]:loc_offsets[i + 1], of i-th species
+# in species_offsets[i]:species_offsets[i + 1], and of i-th of sorted blocks are
+# block_order[block_offsets[i]:block_offsets[i + 1]].
+class BlockTable:
+    def __init__(self, block, species, species_code, chrs, chr_code, beg, end, forward):
+        order = np.lexsort((beg, chr_code, species_code))
+        self.block, self.species_code, self.chr_code = block[order], species_code[order], chr_code[order]
+        self.beg, self.end, self.forward = beg[order], end[order], forward[order]
+        self.species, self.chrs = species, chrs
+
+        loc_start = np.ones(len(order), dtype=bool)
+        loc_start[1:] = (self.species_code[1:] != self.species_code[:-1]) | (self.chr_code[1:] != self.chr_code[:-1])
+        self.loc_code = np.cumsum(loc_start) - 1
+        self.loc_offsets = np.append(np.flatnonzero(loc_start), len(order))
+        self.loc_species = self.species_code[loc_start]
+        self.loc_chr = self.chr_code[loc_start]
+        self.species_offsets = np.searchsorted(self.species_code, np.arange(len(species) + 1))
+
+        self.block_order = np.argsort(self.block, kind='stable')
+        self.blocks, block_starts = np.unique(self.block[self.block_order], return_index=True)
+        self.block_offsets = np.append(block_starts, len(order))
+
+    @classmethod
+    def from_df(cls, df):
+        species_code, species = pd.factorize(df['species'], sort=True)
+        chr_code, chrs = pd.factorize(df['chr'], sort=True)
+        return cls(df['block'].to_numpy(dtype=np.int32), np.asarray(species, dtype=object),
+                   species_code.astype(np.int32), np.asarray(chrs, dtype=object), chr_code.astype(np.int32),
+                   df['chr_beg'].to_numpy(dtype=np.int64), df['chr_end'].to_numpy(dtype=np.int64),
+                   (df['orientation'] == '+').to_numpy())
+
+    def __len__(self):
+        return len(self.block)
+
+    def select(self, mask):
+        return BlockTable(self.block[mask], self.species, self.species_code[mask], self.chrs, self.chr_code[mask],
+                          self.beg[mask], self.end[mask], self.forward[mask])
+
+    def select_blocks(self, allowed_blocks):
+        return self.select(np.isin(self.block, np.array(list(allowed_blocks), dtype=np.int32)))
+
+    # names of locations as keys of chromosomes lengths
+    def loc_names(self):
+        return [f'{self.species[s]}.{self.chrs[c]}' for s, c in zip(self.loc_species.tolist(), self.loc_chr.tolist())]
+
+    def lengths(self):
+        return self.end - self.beg
+
+
+class GenomesPermutations:
+    def __init__(self, genomes, permutations):
+        self.genomes = genomes
+        self.permutations = permutations
+
+    def __len__(self):
+        return len(self.genomes)
+
+    def __iter__(self):
+        return zip(self.genomes, self.permutations)
+
+    def filter_blocks(self, allowed_blocks):
+        allowed_blocks = np.array(list(allowed_blocks), dtype=np.int32)
+        return GenomesPermutations(self.genomes, [permutation[np.isin(np.abs(permutation), allowed_blocks)]
+                                                  for permutation in self.permutations])
+
+    # genomes are written as circular, as bg expects for breakpoint graph construction
+    def grimm_lines(self):
+        for genome, permutation in self:
+            yield f'>{genome}'
+            yield ' '.join(f'{block:+d}' for block in permutation.tolist()) + ' @'
+
+    def write_grimm(self, file_name):
+        with open(file_name, 'w') as f:
+            for line in self.grimm_lines():
+                print(line, file=f)
+
+
+def parse_grimm_data_string(data_string):
+    terminator = GRIMM_TERMINATOR.search(data_string)
+    if terminator: data_string = data_string[:terminator.start()]
+
+    permutation = np.array(data_string.split(), dtype=np.int64)
+    if np.any(permutation == 0) or np.any(np.abs(permutation) > np.iinfo(np.int32).max):
+        raise ValueError(f'Blocks in grimm file must be numbered from 1, got: {data_string[:80]}')
+    return permutation.astype(np.int32)
+
+
+# Reads grimm file line by line, every genome is kept as array of signed block numbers,
+# one line of blocks is expected after genome declaration
+def parse_grimm(grimm_file):
+    genomes, permutations = [], []
+    empty = np.zeros(0, dtype=np.int32)
 
     with open(grimm_file) as f:
-        ls = f.readlines()
-    block_genome_count = defaultdict(Counter)
+        for line in f:
+            line = line.strip()
+            if GRIMMReader.is_genome_declaration_string(line):
+                if len(permutations) < len(genomes): permutations.append(empty)
+                genomes.append(GRIMMReader.parse_genome_declaration_string(line).name)
+            elif len(permutations) < len(genomes) and line and not GRIMMReader.is_comment_string(line):
+                permutations.append(parse_grimm_data_string(line))
 
-    for i in range(0, len(ls), 2):
-        name = GRIMMReader.parse_genome_declaration_string(ls[i]).name
-        data = GRIMMReader.parse_data_string(ls[i + 1])[1]
-        genomes.add(name)
-        for _, block in data:
-            blocks.add(int(block))
-            block_genome_count[int(block)][name] += 1
+    if len(permutations) < len(genomes): permutations.append(empty)
+    return GenomesPermutations(genomes, permutations)
 
-    return list(sorted(genomes)), list(sorted(blocks)), block_genome_count
 
+def get_genomes_contain_blocks_grimm(permutations):
+    block_genome_count = defaultdict(Counter)
 
-def get_block_neighbours(grimm_file):
-    block_neighbours = defaultdict(lambda: defaultdict(list))
-    with open(grimm_file) as f: ls = f.readlines()
+    for genome, permutation in permutations:
+        blocks, counts = np.unique(np.abs(permutation), return_counts=True)
+        for block, count in zip(blocks.tolist(), counts.tolist()):
+            block_genome_count[block][genome] += count
 
-    i = 0
-    while i < len(ls):
-        l = ls[i]
-        if GRIMMReader.is_genome_declaration_string(l):
-            strain = GRIMMReader.parse_genome_declaration_string(l).name
-            data_line = ls[i + 1]
-            bs = GRIMMReader.parse_data_string(data_line)[1]
+    return list(sorted(set(permutations.genomes))), list(sorted(block_genome_count)), block_genome_count
 
-            n = len(bs)
-            j = 0
 
-            while j < n:
-                tandem_copies = 1
-                prev_or, prev_block = bs[j % n]
-                _, curr_block = bs[(j + 1) % n]
-                next_or, next_block = bs[(j + 2) % n]
+# named function instead of lambda keeps neighbours picklable
+def strains_neighbours():
+    return defaultdict(list)
 
-                if curr_block == prev_block:
-                    j += 1
-                    continue
 
-                while curr_block == next_block:
-                    j += 1
-                    tandem_copies += 1
-                    next_or, next_block = bs[(j + 2) % n]
+def get_block_neighbours(permutations):
+    block_neighbours = defaultdict(strains_neighbours)
 
-                neighbours = (prev_block + ('h' if prev_or == '+' else 't'),
-                              next_block + ('t' if next_or == '+' else 'h'))
+    for strain, permutation in permutations:
+        bs, forward = np.abs(permutation).tolist(), (permutation > 0).tolist()
 
-                orientations = tuple(bs[(k + 1) % n][0] for k in range(j - tandem_copies + 1, j + 1))
+        n = len(bs)
+        j = 0
 
-                if orientations[0] == '-':
-                    neighbours = (neighbours[1], neighbours[0])
-                    orientations = tuple('+' if or_ == '-' else '+' for or_ in orientations[::-1])
+        while j < n:
+            tandem_copies = 1
+            prev_block, prev_forward = bs[j % n], forward[j % n]
+            curr_block = bs[(j + 1) % n]
+            next_block, next_forward = bs[(j + 2) % n], forward[(j + 2) % n]
 
-                block_neighbours[int(curr_block)][strain].append((*neighbours, tandem_copies, orientations))
+            if curr_block == prev_block:
+                j += 1
+                continue
 
+            while curr_block == next_block:
                 j += 1
+                tandem_copies += 1
+                next_block, next_forward = bs[(j + 2) % n], forward[(j + 2) % n]
+
+            neighbours = (f'{prev_block}{"h" if prev_forward else "t"}',
+                          f'{next_block}{"t" if next_forward else "h"}')
+
+            orientations = tuple('+' if forward[(k + 1) % n] else '-' for k in range(j - tandem_copies + 1, j + 1))
+
+            if orientations[0] == '-':
+                neighbours = (neighbours[1], neighbours[0])
+                orientations = tuple('+' if or_ == '-' else '+' for or_ in orientations[::-1])
+
+            block_neighbours[curr_block][strain].append((*neighbours, tandem_copies, orientations))
 
-            i += 2
-        else:
-            i += 1
+            j += 1
 
     return block_neighbours
 
@@ -1,6 +1,5 @@
 import numpy as np
-
-from collections import defaultdict
+import pandas as pd
 
 
 def distance_between_blocks_distribution(df_blocks):
@@ -11,46 +10,115 @@ def distance_between_blocks_distribution(df_blocks):
     return ds
 
 
-def distance_between_blocks_dict(df_blocks, genome_length, allowed_blocks=None):
-    distances = defaultdict(lambda: defaultdict(lambda: 1e12))
-
-    if allowed_blocks is None:
-        df = df_blocks.copy()
+# distance used for strains where blocks are not located on the same chromosome
+NO_DISTANCE = 10 ** 12
+# limit for rows of block occurrences combinations processed at once
+DISTANCES_CHUNK_ROWS = 2 ** 22
+
+
+# Minimal distances between pairs of blocks in every strain where they are located on the same chromosome,
+# stored as flat arrays sorted by pair: distances of i-th pair are in range offsets[i]:offsets[i + 1].
+# Distances of the same pair and strain (different copies or chromosomes) are reduced to minimal one.
+class BlocksDistances:
+    def __init__(self, b1, b2, strain_codes, distances, strains):
+        self.strains = list(strains)
+        self.strain_index = {strain: i for i, strain in enumerate(self.strains)}
+
+        n_blocks = int(max(b1.max(initial=0), b2.max(initial=0))) + 1
+        keys = (b1.astype(np.int64) * n_blocks + b2) * max(1, len(self.strains)) + strain_codes
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+        self.distances = np.minimum.reduceat(distances[order], starts) if len(keys) else np.zeros(0, dtype=np.int64)
+        keys = keys[starts]
+        self.strain_codes = keys % max(1, len(self.strains))
+
+        pair_keys = keys // max(1, len(self.strains))
+        pair_starts = np.flatnonzero(np.r_[True, pair_keys[1:] != pair_keys[:-1]]) if len(keys) else starts
+        self.pairs = np.stack([pair_keys[pair_starts] // n_blocks, pair_keys[pair_starts] % n_blocks], axis=1)
+        self.offsets = np.append(pair_starts, len(keys))
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def pair_range(self, pair):
+        b1, b2 = sorted(pair)
+        i = np.searchsorted(self.pairs[:, 0], b1, side='left')
+        j = np.searchsorted(self.pairs[:, 0], b1, side='right')
+        i += np.searchsorted(self.pairs[i:j, 1], b2)
+        if i == j or self.pairs[i, 1] != b2: return 0, 0
+        return self.offsets[i], self.offsets[i + 1]
+
+    def values(self, pair):
+        start, end = self.pair_range(pair)
+        return self.distances[start:end]
+
+    def get(self, pair, strains, default=NO_DISTANCE):
+        start, end = self.pair_range(pair)
+        by_strain = np.full(len(self.strains) + 1, default, dtype=np.int64)
+        by_strain[self.strain_codes[start:end]] = self.distances[start:end]
+        return by_strain[[self.strain_index.get(strain, -1) for strain in strains]]
+
+
+# distance is minimal among all ends of blocks, so orientation of blocks does not matter
+def circular_distances(beg1, end1, beg2, end2, lengths):
+    ds = np.abs(np.stack([beg1 - beg2, beg1 - end2, end1 - beg2, end1 - end2]))
+    return np.minimum(ds, lengths - ds).min(axis=0)
+
+
+def distances_between_blocks(block_table, genome_length, allowed_blocks=None, pairs=None):
+    if pairs is not None:
+        pairs = np.unique(np.sort(np.array(list(pairs), dtype=np.int64).reshape(-1, 2), axis=1), axis=0)
+        # as in all pairs mode, block has no distance to itself
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        allowed_blocks = np.unique(pairs)
+
+    table = block_table if allowed_blocks is None else block_table.select_blocks(allowed_blocks)
+    lengths = np.array([genome_length[loc] for loc in table.loc_names()], dtype=np.int64)
+    block, beg, end = table.block.astype(np.int64), table.beg, table.end
+
+    chunks = []
+    if pairs is not None:
+        # only asked pairs are joined with occurrences of both blocks on the same location
+        occurrences = pd.DataFrame({'block': block, 'loc': table.loc_code, 'row': np.arange(len(table))})
+        per_block = max(1, len(table) // max(1, len(allowed_blocks)))
+        chunk = max(1, DISTANCES_CHUNK_ROWS // per_block ** 2)
+        for i in range(0, len(pairs), chunk):
+            df_comb = pd.DataFrame(pairs[i:i + chunk], columns=['b1', 'b2']) \
+                .merge(occurrences.rename(columns={'block': 'b1', 'row': 'row1'}), on='b1') \
+                .merge(occurrences.rename(columns={'block': 'b2', 'row': 'row2'}), on=['b2', 'loc'])
+            rows1, rows2, locs = df_comb['row1'].to_numpy(), df_comb['row2'].to_numpy(), df_comb['loc'].to_numpy()
+            chunks.append((block[rows1], block[rows2], table.loc_species[locs],
+                           circular_distances(beg[rows1], end[rows1], beg[rows2], end[rows2], lengths[locs])))
     else:
-        df = df_blocks.loc[df_blocks['block'].isin(allowed_blocks)].copy()
-
-    df['real_beg'] = df.apply(lambda row: row.chr_beg if row.orientation == '+' else row.chr_end, axis=1)
-    df['real_end'] = df.apply(lambda row: row.chr_beg if row.orientation == '-' else row.chr_end, axis=1)
-
-    for strain, df_strain in df.groupby('species'):
-        for chr, df_strain_chr in df_strain.groupby('chr'):
-            l = genome_length[strain + '.' + chr]
-
-            xs = df_strain_chr[['block', 'real_beg', 'real_end']].to_numpy()
+        # all pairs of occurrences of different blocks on every location, rows are taken by chunks to bound memory
+        for loc, (start, stop) in enumerate(zip(table.loc_offsets[:-1], table.loc_offsets[1:])):
+            chunk = max(1, DISTANCES_CHUNK_ROWS // max(1, stop - start))
+            for chunk_start in range(start, stop, chunk):
+                chunk_stop = min(stop, chunk_start + chunk)
+                rows1, rows2 = np.nonzero(block[chunk_start:chunk_stop, None] < block[None, start:stop])
+                rows1, rows2 = rows1 + chunk_start, rows2 + start
+                chunks.append((block[rows1], block[rows2], np.full(len(rows1), table.loc_species[loc]),
+                               circular_distances(beg[rows1], end[rows1], beg[rows2], end[rows2], lengths[loc])))
 
-            m, n = xs.shape
+    if not chunks: chunks = [tuple(np.zeros(0, dtype=np.int64) for _ in range(4))]
+    b1, b2, strain_codes, distances = (np.concatenate(columns) for columns in zip(*chunks))
+    return BlocksDistances(b1, b2, strain_codes, distances, table.species)
 
-            combs = np.zeros((m, m, 2 * n), dtype=int)
-            combs[:, :, :n] = xs[:, None, :]
-            combs[:, :, n:] = xs
-            combs.shape = (m * m, -1)
 
-            combs = combs[np.where((combs[:, 3] - combs[:, 0]) > 0), :][0]
+# pairs of blocks which are among k nearest blocks to each other on chromosome of any strain
+def genome_neighbour_pairs(block_table, allowed_blocks, k):
+    table = block_table.select_blocks(allowed_blocks)
+    locs, blocks = table.loc_code, table.block.astype(np.int64)
 
-            for b1, st1, end1, b2, st2, end2 in combs:
-                if b1 >= b2: continue
-                distances[(b1, b2)][strain] = min(distances[(b1, b2)][strain],
-                                                  abs(st1 - st2),
-                                                  l - abs(st1 - st2),
-                                                  abs(st1 - end2),
-                                                  l - abs(st1 - end2),
-                                                  abs(end1 - st2),
-                                                  l - abs(end1 - st2),
-                                                  abs(end1 - end2),
-                                                  l - abs(end1 - end2),
-                                                  )
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for shift in range(1, k + 1):
+        same_loc = locs[shift:] == locs[:-shift]
+        pairs.append(np.stack([blocks[:-shift][same_loc], blocks[shift:][same_loc]], axis=1))
 
-    return distances
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
 
 
 def check_stats_stains(tree, block_genomes, logger):
@@ -80,10 +148,12 @@ def check_stats_stains(tree, block_genomes, logger):
     return block_genomes & tree_genomes
 
 
-def get_coverages(df, genome_lengths):
-    return [sum(df_strain['chr_end'] - df_strain['chr_beg']) / genome_lengths[strain]
-            for strain, df_strain in df.groupby('species')]
+def get_coverages(block_table, genome_lengths):
+    species_code = block_table.species_code
+    covered = np.bincount(species_code, weights=block_table.lengths(), minlength=len(block_table.species))
+    present = np.bincount(species_code, minlength=len(block_table.species)) > 0
+    return [length / genome_lengths[strain] for strain, length, p in zip(block_table.species, covered, present) if p]
 
 
-def get_mean_coverage(df, genome_lengths):
-    return np.mean(get_coverages(df, genome_lengths))
+def get_mean_coverage(block_table, genome_lengths):
+    return np.mean(get_coverages(block_table, genome_lengths))
@@ -1,70 +1,41 @@
-from bg.grimm import GRIMMReader
-from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
 
 
-class Unique_Filter:
-    def __init__(self):
-        self.blocks_copies = defaultdict(lambda: defaultdict(int))
-        self.first_call = True
+# number of copies of every block in every genome as sparse matrix in COO format: blocks, genome codes and copies
+def blocks_copies_matrix(blocks, genome_codes):
+    n_genomes = int(genome_codes.max(initial=0)) + 1
+    keys, copies = np.unique(blocks.astype(np.int64) * n_genomes + genome_codes, return_counts=True)
+    return keys // n_genomes, keys % n_genomes, copies
 
-    def update_allowed_blocks(self, ps, strain):
-        vs = [p[1] for p in ps]
-        for v in vs:
-            self.blocks_copies[v][strain] += 1
+# blocks having exactly one copy in every genome containing them and contained in at least min_genomes genomes
+def unique_allowed_blocks(blocks, copies, min_genomes):
+    unique_blocks, inverse = np.unique(blocks, return_inverse=True)
+    genomes_count = np.bincount(inverse, minlength=len(unique_blocks))
+    has_copies = np.bincount(inverse, weights=copies > 1, minlength=len(unique_blocks)) > 0
+    return unique_blocks[(genomes_count >= min_genomes) & ~has_copies]
 
-    def count_allowed(self, min_genomes):
-        self.allowed_blocks = [b for b, cs in self.blocks_copies.items()
-                               if all(map(lambda c: c == 1, cs.values())) and len(cs) >= min_genomes]
+# copies of blocks in genomes are counted once for all permutations, genome of several permutations
+# (e.g. chromosomes) is counted as one genome
+def grimm_filter_unique_gene(permutations, out_file, block_rate):
+    genome_codes, genomes = pd.factorize(pd.Series(permutations.genomes, dtype=object))
+    lengths = np.array([len(permutation) for permutation in permutations.permutations], dtype=np.int64)
+    all_blocks = np.abs(np.concatenate(permutations.permutations or [np.zeros(0, dtype=np.int64)])).astype(np.int64)
 
-    def filter_unique(self, ps):
-        return [p for p in ps if p[1] in self.allowed_blocks]
+    blocks, _, copies = blocks_copies_matrix(all_blocks, np.repeat(genome_codes.astype(np.int64), lengths))
+    allowed_blocks = unique_allowed_blocks(blocks, copies, block_rate * len(genomes) / 100)
 
-def grimm_filter_unique_gene(in_file, out_file, block_rate):
-    lines = open(in_file).read().split('\n')
-    strains = set()
-
-    # make unique blocks list
-    i = 0
-    flt = Unique_Filter()
-    while i < len(lines):
-        line = lines[i]
-        if GRIMMReader.is_genome_declaration_string(line):
-            strain = GRIMMReader.parse_genome_declaration_string(line).name
-            strains.add(strain)
-
-            data_line = lines[i + 1]
-            parsed = GRIMMReader.parse_data_string(data_line)[1]
-            flt.update_allowed_blocks(parsed, strain)
-            i += 2
-        else:
-            i += 1
-
-    flt.count_allowed(block_rate * len(strains) / 100)
     # write allowed blocks
-    i = 0
-    with open(out_file, 'w') as f:
-        while i < len(lines):
-            line = lines[i]
-            if GRIMMReader.is_genome_declaration_string(line):
-                data_line = lines[i + 1]
-
-                parsed = GRIMMReader.parse_data_string(data_line)[1]
-                parsed = flt.filter_unique(parsed)
-
-                print(line, file=f)
-                print(' '.join(p[0] + p[1] for p in parsed), '@', file=f)
-                i += 2
-            else:
-                i += 1
+    unique_permutations = permutations.filter_blocks(allowed_blocks)
+    unique_permutations.write_grimm(out_file)
 
-    return list(map(int, flt.allowed_blocks))
+    return list(map(int, allowed_blocks)), unique_permutations
 
 def filter_dataframe_unique(df):
-    allowed_blocks = set()
-    all_sp = len(df['species'].unique())
-    for block, df_block in df.groupby('block'):
-        if len(df_block) == len(df_block['species'].unique()) == all_sp:
-            allowed_blocks.add(block)
+    # blocks with exactly one copy in every species
+    species_codes, species = pd.factorize(df['species'])
+    blocks, _, copies = blocks_copies_matrix(df['block'].to_numpy(dtype=np.int64), species_codes)
+    allowed_blocks = unique_allowed_blocks(blocks, copies, len(species))
 
     return df.loc[df['block'].isin(allowed_blocks)].copy()
 
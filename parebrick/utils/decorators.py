@@ -1,23 +1,129 @@
+import cProfile
+import json
+import os
+import sys
 import time
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 sep = '-' * 80
 
+
+def cpu_seconds(who):
+    if resource is None: return None
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+def max_rss_mb(who):
+    if resource is None: return None
+    # kilobytes on Linux, bytes on macOS
+    return resource.getrusage(who).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+# current (VmRSS) or peak (VmHWM) resident set size of process, None if there is no /proc (not Linux)
+def proc_rss_mb(field='VmRSS'):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'): return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    return None
+
+
+# peak resident set size of process is reset to current one (Linux 4.0+), so peak of every module is measured
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Metrics of modules run with decorate: wall and CPU time, memory and counts of processed items.
+# Peak memory of module is measured by resetting peak resident set size of process at its start, it's None where
+# it can't be reset. Peak memory of children is maximum among all finished children since start of run,
+# CPU time of children counts only finished processes, e.g. pools of rendering processes.
+class RunMetrics:
+    def __init__(self):
+        self.modules = []
+        self.file = None
+        self.profile_folder = None
+        self.counts = {}
+
+    def configure(self, file=None, profile_folder=None):
+        self.file, self.profile_folder = file, profile_folder
+        if profile_folder: os.makedirs(profile_folder, exist_ok=True)
+
+    # number of items processed by running module, e.g. characters or rendered trees
+    def count(self, name, value):
+        self.counts[name] = int(value)
+
+    def add(self, module_metrics):
+        self.modules.append(module_metrics)
+        if self.file is None: return
+
+        with open(self.file, 'w') as f:
+            json.dump({'modules': self.modules,
+                       'total_elapsed_seconds': sum(m['elapsed_seconds'] for m in self.modules)}, f, indent=2)
+
+metrics = RunMetrics()
+
+
 def decorate(module_name, logger):
     def actual_decorator(func):
 
         def wrapper(*args, **kwargs):
             start = time.time()
+            cpu_start = time.process_time()
+            children_cpu_start = cpu_seconds(resource.RUSAGE_CHILDREN) if resource else None
+            rss_start = proc_rss_mb()
+            peak_measured = reset_peak_rss()
+            metrics.counts = {}
+
+            profile = cProfile.Profile() if metrics.profile_folder else None
 
             logger.info(f'<Running module: {module_name}>')
             print(sep)
-            return_value = func(*args, **kwargs)
+            failed = True
+            try:
+                if profile: profile.enable()
+                return_value = func(*args, **kwargs)
+                failed = False
+            finally:
+                if profile: profile.disable()
+                end = time.time()
 
-            end = time.time()
+                # metrics and profile are written even if module fails
+                elapsed = end - start
+                metrics.add({
+                    'module': module_name,
+                    'failed': failed,
+                    'elapsed_seconds': elapsed,
+                    'cpu_seconds': time.process_time() - cpu_start,
+                    'children_cpu_seconds': cpu_seconds(resource.RUSAGE_CHILDREN) - children_cpu_start
+                    if resource else None,
+                    'rss_start_mb': rss_start,
+                    'rss_end_mb': proc_rss_mb(),
+                    'peak_rss_mb': proc_rss_mb('VmHWM') if peak_measured else None,
+                    'children_max_rss_mb': max_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+                    'items': metrics.counts,
+                    'items_per_second': {name: count / elapsed if elapsed > 0 else None
+                                         for name, count in metrics.counts.items()},
+                })
+                if profile:
+                    profile.dump_stats(os.path.join(metrics.profile_folder,
+                                                    module_name.lower().replace(' ', '_') + '.prof'))
 
             print(sep)
             logger.info(f'<Module finished: {module_name}>, elapsed {end - start} seconds')
             print()
             print()
+
             return return_value
 
         return wrapper
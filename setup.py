@@ -28,21 +28,27 @@ setup(
     keywords='genome rearrangements, phylogenetic trees, non-convex characters, synteny blocks, phylogenetic tree, '
              'pattern consistency',
     package_dir={'parebrick': 'parebrick'},
-    packages=['parebrick', 'parebrick.characters', 'parebrick.clustering', 'parebrick.tree', 'parebrick.utils',
-              'parebrick.utils.data'],
+    packages=['parebrick', 'parebrick.bench', 'parebrick.characters', 'parebrick.clustering', 'parebrick.tree',
+              'parebrick.utils', 'parebrick.utils.data'],
+    package_data={'parebrick.tree': ['viewer.html']},
     python_requires='>=3.6, <3.9',
     install_requires=
         ['PyQt5', # for ete3 working properly
          'ete3', # phylogenetic trees
          'scikit-learn', # clustering characters
+         'scipy', # distance matrices for clustering
          'seaborn>=0.11.0', # for drawer module
-         'bg'], # breakpoint graphs
+         'bg'], # GRIMM format parsing
     entry_points={
         'console_scripts': [
             'PaReBrick=parebrick.main:main',
             'parebrick=parebrick.main:main',
             'PaReBrick-Charts=parebrick.drawer:main',
             'parebrick-charts=parebrick.drawer:main',
+            'PaReBrick-Render=parebrick.render:main',
+            'parebrick-render=parebrick.render:main',
+            'PaReBrick-Bench=parebrick.bench.run:main',
+            'parebrick-bench=parebrick.bench.run:main',
         ],
     },
 )
\ No newline at end of file